@@ -16,11 +16,14 @@
 #
 #######################################################################
 
+import argparse
 import json
 import os
-import time
+import signal
+import threading
 import re
-from typing import List, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, NamedTuple, Tuple
 
 # 3d party imports
 from lxml import etree
@@ -28,24 +31,62 @@ from mediahaven import MediaHaven
 from mediahaven.oauth2 import RequestTokenError, ROPCGrant
 from mediahaven.mediahaven import ContentType
 from meemoo import Context
-from meemoo.events import Events
+from meemoo.batching import MicroBatcher
+from meemoo.cache import TTLCache
+from meemoo.circuitbreaker import CircuitOpenError, get_circuit_breaker
+from meemoo.events import (
+    Consumer,
+    DelayedRetry,
+    Events,
+    PendingRetries,
+    Publisher,
+)
 from meemoo.helpers import (
-    FTP,
-    get_from_event,
-    is_event_valid,
+    FTPPool,
     InvalidEventException,
+    S3Event,
+    destination_config,
     get_destination_for_cp,
+    normalize_or_id,
+)
+from meemoo.idempotency import (
+    DONE,
+    Checkpoint,
+    EventRecord,
+    IdempotencyStore,
+    event_fingerprint,
 )
+from meemoo.oauth import TokenManager, grant_fetcher
+from meemoo.ratelimit import AdaptiveRateLimiter, ThrottledResource, TokenBucket
+from meemoo.supervisor import Supervisor
+from meemoo.workers import WorkerPool
+from pika.exceptions import AMQPError
 from requests.exceptions import HTTPError, RequestException
 
 # Local imports
-from meemoo.services import OrganisationsService, PIDService, OrgApiError
+from meemoo.services import OrganisationsService, PIDPool, OrgApiError
 from viaa.configuration import ConfigParser
 from viaa.observability import logging
 
 config = ConfigParser()
 log = logging.get_logger(__name__, config=config)
-cp_names = {}
+org_api_config = config.app_cfg.get("organisations-api", {})
+cp_names = TTLCache(
+    maxsize=int(org_api_config.get("cache_maxsize", 1024)),
+    ttl=int(org_api_config.get("cache_ttl", 3600)),
+    negative_ttl=int(org_api_config.get("cache_negative_ttl", 60)),
+    negative_exceptions=(OrgApiError,),
+)
+mediahaven_api_config = config.app_cfg.get("mediahaven-api", {})
+# The PID and Fragment ID of an item by its media ID, for the collaterals
+media_items = TTLCache(
+    maxsize=int(mediahaven_api_config.get("media_cache_maxsize", 1024)),
+    ttl=int(mediahaven_api_config.get("media_cache_ttl", 600)),
+    refresh_ahead=1.0,
+)
+
+
+MD5_PATTERN = re.compile("^[a-fA-F0-9]{32}$")
 
 
 class NackException(Exception):
@@ -59,12 +100,68 @@ class NackException(Exception):
         self.kwargs = kwargs
 
 
-def handle_nack_exception(nack_exception, channel, delivery_tag):
-    """Log an error and send a nack to rabbit"""
+def handle_nack_exception(nack_exception, channel, method, properties, body, ctx):
+    """Log an error and send a nack to rabbit.
+
+    Messages that need to be requeued are retried later via a delay queue, so
+    that the consumer doesn't have to wait.
+
+    Returns:
+        int -- The delay in seconds after which the message is retried, 0 if
+            it is requeued instead, or None if it is dropped.
+    """
     log.error(nack_exception.message, **nack_exception.kwargs)
+    delivery_tag = method.delivery_tag
     if nack_exception.requeue:
-        time.sleep(10)
+        try:
+            delay = get_delayed_retry(ctx).schedule(
+                channel, delivery_tag, properties, body
+            )
+        except AMQPError as error:
+            log.error("Failed to schedule a delayed retry.", error=str(error))
+        else:
+            if delay is None:
+                log.error("Maximum amount of retries reached, dropping message.")
+            return delay
     channel.basic_nack(delivery_tag=delivery_tag, requeue=nack_exception.requeue)
+    return 0 if nack_exception.requeue else None
+
+
+def get_delayed_retry(ctx: Context) -> DelayedRetry:
+    """Return the delayed retry of the incoming messages."""
+    if ctx.delayed_retry is None:
+        incoming_config = ctx.config.app_cfg["rabbitmq"]["incoming"]
+        ctx.delayed_retry = DelayedRetry(
+            get_publisher(ctx),
+            incoming_config["queue"],
+            incoming_config.get("retry_delays", [10]),
+            incoming_config.get("max_retries", 0),
+        )
+    return ctx.delayed_retry
+
+
+def get_pending_retries(ctx: Context) -> PendingRetries:
+    """Return the register of the S3 objects of which an event awaits a retry."""
+    if ctx.pending_retries is None:
+        incoming_config = ctx.config.app_cfg["rabbitmq"]["incoming"]
+        ctx.pending_retries = PendingRetries(
+            grace=int(incoming_config.get("retry_grace", 60))
+        )
+    return ctx.pending_retries
+
+
+def defer_event(channel, method, properties, body, ctx: Context, delay: int):
+    """Let the event wait behind an earlier event of its S3 object that
+    awaits a retry: in the same delay queue, or requeued if `delay` is 0."""
+    if delay:
+        try:
+            get_delayed_retry(ctx).defer(
+                channel, method.delivery_tag, properties, body, delay
+            )
+            return
+        except AMQPError as error:
+            log.error("Failed to defer the event.", error=str(error))
+    channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
 
 
 def construct_destination_path(environment, cp_name, file_type):
@@ -72,13 +169,15 @@ def construct_destination_path(environment, cp_name, file_type):
     return f"/{cp_name}/{destination_folder}"
 
 
-def construct_fts_params_dict(event, pid, file_extension, dest_path, ctx):
+def construct_fts_params_dict(
+    event: S3Event, pid, file_extension, dest_path, ctx
+):
     """"""
     return {
         "source": {
-            "domain": {"name": get_from_event(event, "domain")},
-            "bucket": {"name": get_from_event(event, "bucket")},
-            "object": {"key": get_from_event(event, "object_key")},
+            "domain": {"name": event.domain},
+            "bucket": {"name": event.bucket},
+            "object": {"key": event.object_key},
         },
         "destination": {
             "path": f"/mnt/STORAGE/INGEST/SIDECAR{dest_path}/{pid}{file_extension}",
@@ -87,8 +186,8 @@ def construct_fts_params_dict(event, pid, file_extension, dest_path, ctx):
     }
 
 
-def construct_essence_sidecar(event, pid, cp_name):
-    s3_object_key = get_from_event(event, "object_key")
+def construct_essence_sidecar(event: S3Event, pid, cp_name):
+    s3_object_key = event.object_key
 
     root = etree.Element("MediaHAVEN_external_metadata")
     etree.SubElement(root, "title").text = f"Essence: pid: {pid}"
@@ -101,13 +200,13 @@ def construct_essence_sidecar(event, pid, cp_name):
 
     mdprops = etree.SubElement(root, "MDProperties")
     etree.SubElement(mdprops, "CP").text = cp_name
-    etree.SubElement(mdprops, "CP_id").text = get_from_event(event, "tenant")
+    etree.SubElement(mdprops, "CP_id").text = event.tenant
     etree.SubElement(mdprops, "sp_name").text = "s3"
     etree.SubElement(mdprops, "PID").text = pid
-    etree.SubElement(mdprops, "s3_domain").text = get_from_event(event, "domain")
-    etree.SubElement(mdprops, "s3_bucket").text = get_from_event(event, "bucket")
+    etree.SubElement(mdprops, "s3_domain").text = event.domain
+    etree.SubElement(mdprops, "s3_bucket").text = event.bucket
     etree.SubElement(mdprops, "s3_object_key").text = s3_object_key
-    etree.SubElement(mdprops, "s3_object_owner").text = get_from_event(event, "user")
+    etree.SubElement(mdprops, "s3_object_owner").text = event.user
     etree.SubElement(mdprops, "object_level").text = "file"
     etree.SubElement(mdprops, "object_use").text = "archive_master"
     etree.SubElement(mdprops, "ie_type").text = "n/a"
@@ -115,16 +214,18 @@ def construct_essence_sidecar(event, pid, cp_name):
     etree.SubElement(localids, "Bestandsnaam").text = s3_object_key
 
     # Only add md5 if valid and available from the event.
-    if re.match("^[a-fA-F0-9]{32}$", get_from_event(event, "md5")):
-        etree.SubElement(mdprops, "md5").text = get_from_event(event, "md5")
+    if MD5_PATTERN.match(event.md5):
+        etree.SubElement(mdprops, "md5").text = event.md5
 
     return etree.tostring(
         root, pretty_print=True, encoding="UTF-8", xml_declaration=True
     )
 
 
-def construct_collateral_sidecar(event, pid, media_id, cp_name, object_use):
-    s3_object_key = get_from_event(event, "object_key")
+def construct_collateral_sidecar(
+    event: S3Event, pid, media_id, cp_name, object_use
+):
+    s3_object_key = event.object_key
 
     root = etree.Element("MediaHAVEN_external_metadata")
     etree.SubElement(root, "title").text = f"Collateral: pid: {pid}"
@@ -137,13 +238,13 @@ def construct_collateral_sidecar(event, pid, media_id, cp_name, object_use):
 
     mdprops = etree.SubElement(root, "MDProperties")
     etree.SubElement(mdprops, "CP").text = cp_name
-    etree.SubElement(mdprops, "CP_id").text = get_from_event(event, "tenant")
+    etree.SubElement(mdprops, "CP_id").text = event.tenant
     etree.SubElement(mdprops, "sp_name").text = "s3"
     etree.SubElement(mdprops, "PID").text = pid
-    etree.SubElement(mdprops, "s3_domain").text = get_from_event(event, "domain")
-    etree.SubElement(mdprops, "s3_bucket").text = get_from_event(event, "bucket")
+    etree.SubElement(mdprops, "s3_domain").text = event.domain
+    etree.SubElement(mdprops, "s3_bucket").text = event.bucket
     etree.SubElement(mdprops, "s3_object_key").text = s3_object_key
-    etree.SubElement(mdprops, "s3_object_owner").text = get_from_event(event, "user")
+    etree.SubElement(mdprops, "s3_object_owner").text = event.user
     etree.SubElement(mdprops, "dc_identifier_localid").text = media_id
     etree.SubElement(mdprops, "object_level").text = "file"
     etree.SubElement(mdprops, "object_use").text = object_use
@@ -152,8 +253,8 @@ def construct_collateral_sidecar(event, pid, media_id, cp_name, object_use):
     etree.SubElement(localids, "Bestandsnaam").text = s3_object_key
 
     # Only add md5 if valid and available from the event.
-    if re.match("^[a-fA-F0-9]{32}$", get_from_event(event, "md5")):
-        etree.SubElement(mdprops, "md5").text = get_from_event(event, "md5")
+    if MD5_PATTERN.match(event.md5):
+        etree.SubElement(mdprops, "md5").text = event.md5
 
     relations = etree.SubElement(mdprops, "dc_relations")
     etree.SubElement(relations, "is_verwant_aan").text = pid
@@ -179,7 +280,9 @@ def get_cp_name(or_id: str, ctx: Context) -> str:
 
     The mapping between the OR ID and the CP MAM Name is cached.
     If the mapping is not found, The organisations API will be queried to retrieve
-    that information. That information will be cached in a dictionary.
+    that information. That information will be cached with a TTL, and refreshed
+    in the background when it is about to expire. Unknown OR IDs are cached
+    for a shorter time.
 
     Arguments:
         or_id {str} -- The OR ID
@@ -187,13 +290,10 @@ def get_cp_name(or_id: str, ctx: Context) -> str:
     Returns:
         str -- The CP MAM Name
     """
-    if or_id in cp_names:
-        return cp_names[or_id]
-
-    org_service = OrganisationsService(ctx)
-
     try:
-        cp_name = org_service.get_mam_label(or_id)
+        cp_name = cp_names.get(
+            or_id, lambda or_id: OrganisationsService(ctx).get_mam_label(or_id)
+        )
     except OrgApiError as e:
         raise NackException(str(e))
     except RequestException as error:
@@ -208,11 +308,46 @@ def get_cp_name(or_id: str, ctx: Context) -> str:
             f"The organisation exists but there is no mam label for or-id: {or_id}",
         )
 
-    cp_names[or_id] = cp_name
     return cp_name
 
 
-def query_params_item_ingested(event: dict, cp_name: str) -> List[Tuple[str, str]]:
+def warm_up_cp_names(ctx: Context):
+    """Fill the cache of CP MAM Names with all the organisations at once.
+
+    If configured, the cache gets refreshed with all the organisations on a
+    timer. Failures are only logged, the CP MAM Names will then be retrieved
+    one by one in `get_cp_name`.
+    """
+    org_config = ctx.config.app_cfg["organisations-api"]
+    try:
+        mam_labels = OrganisationsService(ctx).get_mam_labels(
+            int(org_config.get("warm_up_page_size", 500))
+        )
+    except (OrgApiError, RequestException, CircuitOpenError) as error:
+        log.warning("Failed to warm up the CP names.", error=str(error))
+    except Exception as error:
+        log.error("Unexpected error while warming up the CP names.", error=str(error))
+    else:
+        for or_id, mam_label in mam_labels.items():
+            if not or_id or not mam_label:
+                continue
+            try:
+                cp_names[normalize_or_id(or_id)] = mam_label
+            except (ValueError, AttributeError):
+                log.debug(f"Skipping invalid OR ID: {or_id}")
+        log.info(f"Warmed up the CP names of {len(mam_labels)} organisations.")
+    finally:
+        # Whatever happened, keep refreshing
+        interval = int(org_config.get("warm_up_interval", 0))
+        if interval:
+            timer = threading.Timer(interval, warm_up_cp_names, args=(ctx,))
+            timer.daemon = True
+            timer.start()
+
+
+def query_params_item_ingested(
+    event: S3Event, cp_name: str
+) -> List[Tuple[str, str]]:
     """Construct the query parameters to check if an item is already in the MAM.
 
     A check on S3 object key is always needed.
@@ -224,34 +359,34 @@ def query_params_item_ingested(event: dict, cp_name: str) -> List[Tuple[str, str
         List[Tuple[str, str]] -- The query params.
     """
     # Check based on the S3 object key
-    query_params = [("s3_object_key", get_from_event(event, "object_key"))]
+    query_params = [("s3_object_key", event.object_key)]
 
     # Check based on md5 if:
     #  - the md5 is available and
     #  - the CP is not VRT unless the item is a collateral
-    md5 = get_from_event(event, "md5")
+    md5 = event.md5
     if md5 and (cp_name.upper() not in ("VRT") or is_collateral(event)):
         query_params.append(("md5", md5))
 
     return query_params
 
 
-def is_collateral(event: dict) -> bool:
+def is_collateral(event: S3Event) -> bool:
     """Check if the event is a collateral."""
-    return get_from_event(event, "bucket") == "mam-collaterals"
-
+    return event.bucket == "mam-collaterals"
 
-def handle_create_event(
-    event: dict, properties, ctx: Context, mediahaven_client: MediaHaven
-) -> bool:
-    """Handler for s3 create events"""
 
-    # Get cp_name for or_id
-    or_id = get_from_event(event, "tenant")
-    cp_name = get_cp_name(or_id, ctx)
+def find_media_item(
+    media_id: str, mediahaven_client: MediaHaven
+) -> Tuple[str, str]:
+    """Find the item in MediaHaven for a media ID.
 
-    # Check if item already in mediahaven
-    query_params = query_params_item_ingested(event, cp_name)
+    Returns:
+        Tuple[str, str] -- The PID and Fragment ID of the item.
+    """
+    query_params = [
+        ("dc_identifier_localid", media_id),
+    ]
     query = get_mediahaven_query(query_params)
     try:
         result = mediahaven_client.records.search(q=query)
@@ -268,100 +403,263 @@ def handle_create_event(
             error=error,
             error_message=error.response.text,
         )
+    if not result.nr_of_results:
+        raise NackException(
+            f"Item not found in MediaHaven for dc_identifier_localid: {media_id}"
+        )
 
-    if result.nr_of_results:
-        log.warning(
-            "Item already archived", s3_object_key=get_from_event(event, "object_key")
+    return result[0].Dynamic.PID, result[0].Internal.FragmentId
+
+
+def _get_record_field(item, *path):
+    """Safely get a (nested) field of a MediaHaven record."""
+    for name in path:
+        item = getattr(item, name, None)
+        if item is None:
+            return None
+    return item
+
+
+def check_items_ingested(
+    batch: List[List[Tuple[str, str]]], mediahaven_client: MediaHaven
+) -> List[bool]:
+    """Check for a batch of items if they are already in the MAM.
+
+    All the query params of the batch are OR'ed into a single query. The
+    results are mapped back to the items via their S3 object key and md5. If
+    a result can't be mapped back, every item is checked on its own.
+
+    Arguments:
+        batch {List[List[Tuple[str, str]]]} -- The query params per item, see
+            `query_params_item_ingested`.
+    Returns:
+        List[bool] -- Per item if it is already in the MAM.
+    """
+    if len(batch) == 1:
+        result = mediahaven_client.records.search(q=get_mediahaven_query(batch[0]))
+        return [bool(result.nr_of_results)]
+
+    all_query_params = list(
+        dict.fromkeys(param for params in batch for param in params)
+    )
+    result = mediahaven_client.records.search(
+        q=get_mediahaven_query(all_query_params)
+    )
+    if not result.nr_of_results:
+        return [False] * len(batch)
+
+    found = set()
+    for item in result.as_generator():
+        s3_object_key = _get_record_field(item, "Dynamic", "s3_object_key")
+        md5 = _get_record_field(item, "Technical", "Md5")
+        if not s3_object_key and not md5:
+            log.debug("Unable to map the batched results, checking one by one.")
+            return [
+                check_items_ingested([params], mediahaven_client)[0]
+                for params in batch
+            ]
+        if s3_object_key:
+            found.add(("s3_object_key", s3_object_key))
+        if md5:
+            found.add(("md5", md5.lower()))
+
+    def normalize(key, value):
+        return (key, value.lower() if key == "md5" else value)
+
+    return [
+        any(normalize(key, value) in found for key, value in params)
+        for params in batch
+    ]
+
+
+def get_ingest_check_batcher(ctx: Context, mediahaven_client: MediaHaven):
+    """Return the batcher of the checks if items are already in the MAM.
+
+    Returns None if batching is disabled, i.e. a batch size of 1.
+    """
+    mediahaven_config = ctx.config.app_cfg["mediahaven-api"]
+    batch_size = int(mediahaven_config.get("ingest_check_batch_size", 1))
+    if batch_size <= 1:
+        return None
+    if ctx.ingest_check_batcher is None:
+        ctx.ingest_check_batcher = MicroBatcher(
+            lambda batch: check_items_ingested(batch, mediahaven_client),
+            batch_size,
+            int(mediahaven_config.get("ingest_check_batch_wait_ms", 50)) / 1000,
+        )
+    return ctx.ingest_check_batcher
+
+
+def lookup_event(ctx: Context, event: S3Event) -> EventRecord:
+    """The recorded outcome of an earlier delivery of the event, if any."""
+    if ctx.idempotency_store is None:
+        return None
+    return ctx.idempotency_store.get(event_fingerprint(event))
+
+
+def remember_event(ctx: Context, event: S3Event, outcome: str, **data):
+    """Record the outcome of the event, for redeliveries and duplicates."""
+    if ctx.idempotency_store is not None:
+        ctx.idempotency_store.record(
+            event_fingerprint(event), event.bucket, event.object_key, outcome, **data
         )
+
+
+def load_checkpoint(ctx: Context, event: S3Event) -> Checkpoint:
+    """The checkpoint of an earlier attempt at the create event, if any."""
+    if ctx.idempotency_store is None:
+        return Checkpoint()
+    return ctx.idempotency_store.get_checkpoint(
+        event.bucket, event.object_key, event.md5 or ""
+    )
+
+
+def save_checkpoint(
+    ctx: Context, event: S3Event, checkpoint: Checkpoint, **steps
+) -> Checkpoint:
+    """Add the finished steps to the checkpoint of the create event."""
+    checkpoint = checkpoint._replace(**steps)
+    if ctx.idempotency_store is not None:
+        ctx.idempotency_store.save_checkpoint(
+            event.bucket, event.object_key, event.md5 or "", checkpoint
+        )
+    return checkpoint
+
+
+def handle_create_event(
+    event: S3Event, properties, ctx: Context, mediahaven_client: MediaHaven
+) -> bool:
+    """Handler for s3 create events
+
+    Every step is checkpointed, so that a retry resumes at the first
+    unfinished step: it reuses the PID, the sidecar and the FTP transfer of
+    the earlier attempt.
+    """
+
+    record = lookup_event(ctx, event)
+    if record is not None and record.outcome == DONE:
+        log.info("Event already handled, skipping.", s3_object_key=event.object_key)
         return
 
-    # Check if we are dealing with essence or collateral
-    if is_collateral(event):
-        # Handle collateral
-        object_key = get_from_event(event, "object_key")
-        try:
-            collateral_type = object_key.split("/")[0]
-            media_id = object_key.split("/")[1]
-        except IndexError as error:
-            # Object key is not properly formatted as <collateral_type>/<media_id>/
-            raise NackException(
-                f"Non-compliant object key for collateral: {object_key}",
-                error=error,
+    checkpoint = load_checkpoint(ctx, event)
+    if checkpoint.sidecar is not None and not checkpoint.publishing:
+        # The transfer isn't requested yet, so it can't have been archived
+        log.info("Resuming event.", s3_object_key=event.object_key)
+    else:
+        # Get cp_name for or_id
+        cp_name = get_cp_name(event.tenant, ctx)
+        if check_item_ingested(event, cp_name, ctx, mediahaven_client):
+            log.warning("Item already archived", s3_object_key=event.object_key)
+            remember_event(ctx, event, DONE)
+            return
+
+    if checkpoint.sidecar is None:
+        # Check if we are dealing with essence or collateral
+        if is_collateral(event):
+            checkpoint = prepare_collateral(
+                event, cp_name, ctx, mediahaven_client, checkpoint
             )
+        else:
+            checkpoint = prepare_essence(event, cp_name, ctx, checkpoint)
 
-        log.debug(f"Received a {collateral_type} for media id: {media_id}")
+    if checkpoint.fragment_id and not checkpoint.fragment_updated:
+        link_collateral(event, checkpoint, mediahaven_client)
+        checkpoint = save_checkpoint(ctx, event, checkpoint, fragment_updated=True)
 
-        query_params = [
-            ("dc_identifier_localid", media_id),
-        ]
-        query = get_mediahaven_query(query_params)
+    pid = checkpoint.pid
+    dest_path = checkpoint.dest_path
+    log.debug(f"Destination: path={dest_path}, file_name={checkpoint.dest_filename}")
+
+    # Transfer sidecar to FTP TRA
+    if not checkpoint.transferred:
         try:
-            result = mediahaven_client.records.search(q=query)
-        except RequestException as error:
-            raise NackException(
-                "Error connecting to MediaHaven, retrying....",
-                error=error,
-                requeue=True,
+            get_ftp_pool(ctx).put(
+                checkpoint.sidecar, dest_path, checkpoint.dest_filename
             )
-        except HTTPError as error:
+        except CircuitOpenError:
+            raise
+        except Exception as error:
+            # The earlier steps are checkpointed: retry, resuming here
             raise NackException(
-                "Error occurred when querying MediaHaven",
-                query_params=query_params,
+                "Error transferring sidecar via FTP, retrying...",
+                sidecar=checkpoint.sidecar,
                 error=error,
-                error_message=error.response.text,
-            )
-        if not result.nr_of_results:
-            raise NackException(
-                f"Item not found in MediaHaven for dc_identifier_localid: {media_id}"
+                requeue=True,
             )
+        checkpoint = save_checkpoint(ctx, event, checkpoint, transferred=True)
+
+    # Request file transfer
+    file_extension = os.path.splitext(event.object_key)[1]
+    param_dict = construct_fts_params_dict(event, pid, file_extension, dest_path, ctx)
 
-        item_pid = result[0].Dynamic.PID
-        item_fragment_id = result[0].Internal.FragmentId
+    save_checkpoint(ctx, event, checkpoint, publishing=True)
+    try:
+        get_publisher(ctx).publish(json.dumps(param_dict), properties.correlation_id)
+    except AMQPError as error:
+        # The sidecar is on the FTP server: retry, resuming from the journal
+        raise NackException(
+            "Error requesting the file transfer, retrying...",
+            error=error,
+            requeue=True,
+        )
+    remember_event(ctx, event, DONE, pid=pid)
 
-        log.debug(f"Found pid: {item_pid} for media id: {media_id}")
 
-        pid = f"{item_pid}_{collateral_type}"
-        dest_path = construct_destination_path(
-            ctx.config.app_cfg["environment"], cp_name, "collateral"
+def check_item_ingested(
+    event: S3Event, cp_name: str, ctx: Context, mediahaven_client: MediaHaven
+) -> bool:
+    """Check if the item is already in MediaHaven."""
+    query_params = query_params_item_ingested(event, cp_name)
+    batcher = get_ingest_check_batcher(ctx, mediahaven_client)
+    try:
+        if batcher:
+            return batcher.submit(query_params)
+        return check_items_ingested([query_params], mediahaven_client)[0]
+    except RequestException as error:
+        raise NackException(
+            "Error connecting to MediaHaven, retrying....",
+            error=error,
+            requeue=True,
+        )
+    except HTTPError as error:
+        raise NackException(
+            "Error occurred when querying MediaHaven",
+            query_params=query_params,
+            error=error,
+            error_message=error.response.text,
         )
-        dest_filename = f"{pid}.xml"
 
-        if collateral_type in ("openOt", "closedOt"):
-            object_use = "subtitle"
-        else:
-            object_use = "collateral"
 
-        sidecar_xml = construct_collateral_sidecar(
-            event, item_pid, media_id, cp_name, object_use
+def get_collateral_type(object_key: str) -> Tuple[str, str]:
+    """The collateral type and media id from an object key formatted as
+    <collateral_type>/<media_id>/..."""
+    try:
+        collateral_type = object_key.split("/")[0]
+        media_id = object_key.split("/")[1]
+    except IndexError as error:
+        raise NackException(
+            f"Non-compliant object key for collateral: {object_key}",
+            error=error,
         )
+    return collateral_type, media_id
 
-        essence_update_sidecar = construct_fragment_update_sidecar(pid)
-        try:
-            mediahaven_client.records.update(
-                item_fragment_id,
-                metadata=essence_update_sidecar,
-                metadata_content_type=ContentType.XML.value,
-                reason=f"[s3-events-handler] Voeg relatie van {object_use} toe",
-            )
-        except RequestException as error:
-            raise NackException(
-                "Error connecting to MediaHaven, retrying....",
-                error=error,
-                requeue=True,
-            )
-        except HTTPError as error:
-            raise NackException(
-                "Error occurred when updating metadata of collateral",
-                fragment_id=item_fragment_id,
-                sidecar=essence_update_sidecar,
-                error=error,
-                error_message=error.response.text,
-            )
+
+def get_object_use(collateral_type: str) -> str:
+    if collateral_type in ("openOt", "closedOt"):
+        return "subtitle"
+    return "collateral"
+
+
+def prepare_essence(
+    event: S3Event, cp_name: str, ctx: Context, checkpoint: Checkpoint
+) -> Checkpoint:
+    """Get a PID, unless the checkpoint has one, and build the sidecar."""
+    if checkpoint.pid is not None:
+        pid = checkpoint.pid
+        log.info(f"Reusing PID: {pid}")
     else:
-        # Handle essence
         try:
-            pid_service = PIDService(ctx)
-            pid = pid_service.get_pid()
+            pid = get_pid_pool(ctx).get_pid()
         except (RequestException, IndexError, KeyError) as error:
             raise NackException(
                 "Unable to get a PID, retrying...",
@@ -370,53 +668,123 @@ def handle_create_event(
             )
 
         log.info(f"PID received: {pid}")
+        checkpoint = save_checkpoint(ctx, event, checkpoint, pid=pid)
 
-        dest_path = construct_destination_path(
-            ctx.config.app_cfg["environment"], cp_name, "essence"
-        )
-        dest_filename = f"{pid}.xml"
+    dest_path = construct_destination_path(
+        ctx.config.app_cfg["environment"], cp_name, "essence"
+    )
+    return save_checkpoint(
+        ctx,
+        event,
+        checkpoint,
+        sidecar=construct_essence_sidecar(event, pid, cp_name),
+        dest_path=dest_path,
+        dest_filename=f"{pid}.xml",
+    )
 
-        sidecar_xml = construct_essence_sidecar(event, pid, cp_name)
 
-    # # Build the sidecar
-    # sidecar_builder = SidecarBuilder(ctx)
-    # log.debug(f"Item md5: {event['Records'][0]['s3']['object']['metadata']['x-md5sum-meta']}")
-    # metadata_dict = {
-    #     "Dynamic": {
-    #         "s3_object_key": event["Records"][0]["s3"]["object"]["key"],
-    #         "s3_bucket": event["Records"][0]["s3"]["bucket"]["name"],
-    #         "PID": pid
-    #     },
-    #     "Technical": {
-    #         "Md5": event["Records"][0]["s3"]["object"]["metadata"]["x-md5sum-meta"]
-    #     }
-    # }
+def prepare_collateral(
+    event: S3Event,
+    cp_name: str,
+    ctx: Context,
+    mediahaven_client: MediaHaven,
+    checkpoint: Checkpoint,
+) -> Checkpoint:
+    """Find the item of the collateral and build the sidecar."""
+    collateral_type, media_id = get_collateral_type(event.object_key)
 
-    # sidecar_builder.build(metadata_dict)
+    log.debug(f"Received a {collateral_type} for media id: {media_id}")
 
-    # # Send the sidecar to TRA-server
-    # # Get the sidecar XML representation as bytes
-    # sidecar_xml = sidecar_builder.to_bytes(pretty=True)
-    # log.debug(sidecar_xml.decode('utf-8'))
+    item_pid, item_fragment_id = media_items.get(
+        media_id, lambda media_id: find_media_item(media_id, mediahaven_client)
+    )
 
-    log.debug(f"Destination: path={dest_path}, file_name={dest_filename}")
+    log.debug(f"Found pid: {item_pid} for media id: {media_id}")
 
-    # Transfer sidecar to FTP TRA
+    pid = f"{item_pid}_{collateral_type}"
+    dest_path = construct_destination_path(
+        ctx.config.app_cfg["environment"], cp_name, "collateral"
+    )
+    sidecar_xml = construct_collateral_sidecar(
+        event, item_pid, media_id, cp_name, get_object_use(collateral_type)
+    )
+    return save_checkpoint(
+        ctx,
+        event,
+        checkpoint,
+        pid=pid,
+        sidecar=sidecar_xml,
+        dest_path=dest_path,
+        dest_filename=f"{pid}.xml",
+        fragment_id=item_fragment_id,
+    )
+
+
+def link_collateral(
+    event: S3Event, checkpoint: Checkpoint, mediahaven_client: MediaHaven
+):
+    """Add the relation to the collateral to the fragment of its item."""
+    collateral_type, _ = get_collateral_type(event.object_key)
+    object_use = get_object_use(collateral_type)
+    essence_update_sidecar = construct_fragment_update_sidecar(checkpoint.pid)
     try:
-        ftp = FTP(ctx)
-        ftp.put(sidecar_xml, dest_path, dest_filename)
-    except Exception as error:
-        # Potential destructive action has happened, allowed to requeue?
+        mediahaven_client.records.update(
+            checkpoint.fragment_id,
+            metadata=essence_update_sidecar,
+            metadata_content_type=ContentType.XML.value,
+            reason=f"[s3-events-handler] Voeg relatie van {object_use} toe",
+        )
+    except RequestException as error:
         raise NackException(
-            "Error transferring sidecar via FTP", sidecar=sidecar_xml, error=error
+            "Error connecting to MediaHaven, retrying....",
+            error=error,
+            requeue=True,
+        )
+    except HTTPError as error:
+        raise NackException(
+            "Error occurred when updating metadata of collateral",
+            fragment_id=checkpoint.fragment_id,
+            sidecar=essence_update_sidecar,
+            error=error,
+            error_message=error.response.text,
         )
 
-    # Request file transfer
-    file_extension = os.path.splitext(get_from_event(event, "object_key"))[1]
-    param_dict = construct_fts_params_dict(event, pid, file_extension, dest_path, ctx)
 
-    events = Events(ctx.config.app_cfg["rabbitmq"]["outgoing"], ctx)
-    events.publish(json.dumps(param_dict), properties.correlation_id)
+def get_publisher(ctx: Context) -> Publisher:
+    """Return the long-lived publisher for the outgoing messages.
+
+    The publisher is normally set up in `main`, sharing the connection of the
+    consumer. If not, it is created once with its own connection.
+    """
+    if ctx.publisher is None:
+        ctx.publisher = Publisher(ctx.config.app_cfg["rabbitmq"]["outgoing"], ctx)
+    return ctx.publisher
+
+
+def get_ftp_pool(ctx: Context) -> FTPPool:
+    """Return the pool of FTP sessions to the transport server."""
+    if ctx.ftp_pool is None:
+        ctx.ftp_pool = FTPPool(ctx)
+    return ctx.ftp_pool
+
+
+def get_pid_pool(ctx: Context) -> PIDPool:
+    """Return the local reservoir of PIDs."""
+    if ctx.pid_pool is None:
+        ctx.pid_pool = PIDPool(ctx)
+    return ctx.pid_pool
+
+
+def get_mediahaven_limiter(ctx: Context) -> AdaptiveRateLimiter:
+    """The limiter shared by all calls to MediaHaven."""
+    if ctx.mediahaven_limiter is None:
+        mediahaven_config = ctx.config.app_cfg["mediahaven-api"]
+        ctx.mediahaven_limiter = AdaptiveRateLimiter(
+            mediahaven_config.get("rate", 10),
+            min_rate=mediahaven_config.get("min_rate", 1),
+            max_rate=mediahaven_config.get("max_rate", 100),
+        )
+    return ctx.mediahaven_limiter
 
 
 def delete_media_object(
@@ -443,6 +811,48 @@ def delete_media_object(
         )
 
 
+def get_delete_limiter(ctx: Context) -> TokenBucket:
+    """Return the rate limiter of the deletes in MediaHaven."""
+    if ctx.delete_limiter is None:
+        mediahaven_config = ctx.config.app_cfg["mediahaven-api"]
+        ctx.delete_limiter = TokenBucket(mediahaven_config.get("delete_rate", 10))
+    return ctx.delete_limiter
+
+
+def delete_media_objects(
+    mediahaven_client: MediaHaven, deletions: List[Tuple[str, str]], ctx: Context
+) -> List[Tuple[str, NackException]]:
+    """Delete media objects concurrently, limited to the configured rate.
+
+    Arguments:
+        deletions {List[Tuple[str, str]]} -- The fragment IDs with their reason.
+    Returns:
+        List[Tuple[str, NackException]] -- The fragment IDs that failed to be
+            deleted, with the reason why.
+    """
+    limiter = get_delete_limiter(ctx)
+    concurrency = ctx.config.app_cfg["mediahaven-api"].get("delete_concurrency", 4)
+
+    def delete(fragment_id, reason):
+        limiter.acquire()
+        delete_media_object(mediahaven_client, fragment_id, reason)
+
+    failures = []
+    if not deletions:
+        return failures
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(deletions))) as executor:
+        futures = {
+            executor.submit(delete, fragment_id, reason): fragment_id
+            for fragment_id, reason in deletions
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except NackException as error:
+                failures.append((futures[future], error))
+    return failures
+
+
 def get_mediahaven_query(query_params: List[Tuple[str, str]], or_params=True) -> str:
     query = (
         "+(" + " ".join([f'{k_v[0]}:"{k_v[1]}"' for k_v in query_params]) + ")"
@@ -452,34 +862,65 @@ def get_mediahaven_query(query_params: List[Tuple[str, str]], or_params=True) ->
     return query
 
 
-def handle_remove_event(
-    event: dict, properties, ctx: Context, mediahaven_client: MediaHaven
-) -> bool:
-    """Handler for s3 removed events
+class RemovalPlan(NamedTuple):
+    """What needs to be deleted in MediaHaven for a removed S3 object.
 
-    First we query MH with the s3_object_key and s3_bucket
-
-    This results in the main object (= essence) and its real fragments.
-    The real fragments potentially have collaterals linked that need to be deleted.
-    So we query all the objects with the media ID of the fragments.
-    Of those we filter out the real fragments. We should end up with only the
-    collaterals. These will be deleted one by one. Finally, delete the essence.
+    The collaterals are deleted first, the essence last.
     """
 
-    # Get cp_name for or_id
-    or_id = get_from_event(event, "tenant")
-    cp_name = get_cp_name(or_id, ctx)
+    s3_bucket: str
+    s3_object_key: str
+    essence_fragment_id: str
+    # Fragment ID of the fragments by their Media ID
+    fragments: dict
+    # Fragment ID and Media ID of the collaterals linked to the fragments
+    collaterals: List[Tuple[str, str]]
+    essence_media_id: str = None
+
+    def media_ids(self) -> List[str]:
+        """The Media IDs of the essence and its fragments."""
+        media_ids = list(self.fragments.keys())
+        if self.essence_media_id:
+            media_ids.insert(0, self.essence_media_id)
+        return media_ids
+
+    def collateral_deletions(self) -> List[Tuple[str, str]]:
+        """The Fragment IDs of the collaterals with their delete reason."""
+        deletions = []
+        for fragment_id, local_id in self.collaterals:
+            # Get the Fragment ID of the fragment to which this collateral is linked to
+            linked_fragment_id = self.fragments.get(local_id)
+            deletions.append(
+                (
+                    fragment_id,
+                    f'Deleted collateral with local_id: "{local_id}" linked to fragment with fragment_id: "{linked_fragment_id}". Essence was deleted via s3 delete-object.',
+                )
+            )
+        return deletions
 
-    # Query MH with the s3_bucket en s3_object_key
-    s3_bucket = get_from_event(event, "bucket")
-    s3_object_key = get_from_event(event, "object_key")
-    query_params = [
-        ("s3_object_key", s3_object_key),
-        ("s3_bucket", s3_bucket),
-    ]
-    query = get_mediahaven_query(query_params, or_params=False)
+    def essence_deletion(self) -> Tuple[str, str]:
+        """The Fragment ID of the essence with its delete reason."""
+        return (
+            self.essence_fragment_id,
+            f's3 delete-object for bucket: "{self.s3_bucket}" and key: "{self.s3_object_key}"',
+        )
+
+    def summary(self) -> dict:
+        return {
+            "s3_bucket": self.s3_bucket,
+            "s3_object_key": self.s3_object_key,
+            "essence_fragment_id": self.essence_fragment_id,
+            "nr_of_fragments": len(self.fragments),
+            "nr_of_collaterals": len(self.collaterals),
+        }
+
+
+def search_mediahaven(
+    mediahaven_client: MediaHaven, query: str, query_params: List[Tuple[str, str]]
+):
+    """Search MediaHaven, raising a NackException upon errors."""
     try:
-        result = mediahaven_client.records.search(q=query)
+        return mediahaven_client.records.search(q=query)
     except RequestException as error:
         raise NackException(
             "Error connecting to MediaHaven, retrying....",
@@ -494,116 +935,415 @@ def handle_remove_event(
             error_message=error.response.text,
         )
 
-    if not result.nr_of_results:
-        log.info(
-            f"No media object found with s3 bucket: {s3_bucket} and object key: {s3_object_key}"
-        )
-        return
 
-    log.info(
-        f"Removing media object with s3 bucket: {s3_bucket} and object key: {s3_object_key}"
-    )
+def search_collaterals(
+    mediahaven_client: MediaHaven, media_ids: List[str], ctx: Context
+) -> List[Tuple[str, str]]:
+    """Query all the objects with the given media IDs and keep the collaterals.
 
-    # Collect the Media ID (and Fragment ID) of the fragments. These will be used to remove the collaterals.
-    fragments = {}
-    for item in result.as_generator():
-        if item.Internal.IsFragment:
-            fragments[item.Dynamic.dc_identifier_localid] = item.Internal.FragmentId
+    The media IDs are split into chunks, so that the queries stay small. The
+    chunks are searched concurrently and all the pages of each result are
+    merged.
 
-    try:
-        # Get the Fragment ID of the essence to delete
-        fragment_id_essence = next(
-            item.Internal.FragmentId
-            for item in result.as_generator()
-            if not item.Internal.IsFragment
-        )
-    except StopIteration:
-        # Should not occur
-        return
+    Returns:
+        List[Tuple[str, str]] -- The Fragment ID and Media ID of the collaterals.
+    """
+    mediahaven_config = ctx.config.app_cfg["mediahaven-api"]
+    chunk_size = int(mediahaven_config.get("fragment_lookup_chunk_size", 50))
+    concurrency = int(mediahaven_config.get("fragment_lookup_concurrency", 4))
 
-    if fragments:
-        # Query all the objects with the media IDs of the fragments
+    def search_chunk(chunk):
         query_params_media_ids = [
-            ("dc_identifier_localid", media_id) for media_id in fragments.keys()
+            ("dc_identifier_localid", media_id) for media_id in chunk
         ]
         query_media_ids = get_mediahaven_query(query_params_media_ids)
-        try:
-            response = mediahaven_client.records.search(q=query_media_ids)
-        except RequestException as error:
-            raise NackException(
-                "Error connecting to MediaHaven, retrying....",
-                error=error,
-                requeue=True,
-            )
-        except HTTPError as error:
-            raise NackException(
-                "Error occurred when querying MediaHaven",
-                query_params=query_params_media_ids,
-                error=error,
-                error_message=error.response.text,
-            )
+        response = search_mediahaven(
+            mediahaven_client, query_media_ids, query_params_media_ids
+        )
 
         # Collect the Fragment IDs of the collaterals. The Media ID is used in the delete reason.
-        fragments_collateral = [
+        return [
             (item.Internal.FragmentId, item.Dynamic.dc_identifier_localid)
             for item in response.as_generator()
             if not item.Internal.IsFragment
         ]
 
-        # Delete the collaterals
-        for fragment_collateral in fragments_collateral:
-            # Get the Fragment ID of the fragment to which this collateral is linked to
-            local_id = fragment_collateral[1]
-            linked_fragment_id = fragments.get(local_id)
-            result = delete_media_object(
-                mediahaven_client,
-                fragment_collateral[0],
-                f'Deleted collateral with local_id: "{local_id}" linked to fragment with fragment_id: "{linked_fragment_id}". Essence was deleted via s3 delete-object.',
-            )
-            time.sleep(0.1)  # Sleep to not hit rate limit
+    media_ids = list(media_ids)
+    chunks = [
+        media_ids[i : i + chunk_size] for i in range(0, len(media_ids), chunk_size)
+    ]
+    if len(chunks) <= 1:
+        return search_chunk(media_ids) if media_ids else []
 
-    # Delete the essence
-    delete_media_object(
-        mediahaven_client,
+    fragments_collateral = []
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(chunks))) as executor:
+        for collaterals in executor.map(search_chunk, chunks):
+            fragments_collateral.extend(collaterals)
+    return fragments_collateral
+
+
+def plan_removal(event: S3Event, mediahaven_client: MediaHaven, ctx: Context):
+    """Plan the removal of the essence, its fragments and their collaterals.
+
+    The search results are streamed exactly once: the fragments are collected
+    and the essence is picked out in the same pass.
+
+    Returns:
+        RemovalPlan -- The plan, or None if there is no essence.
+    """
+    # Query MH with the s3_bucket en s3_object_key
+    s3_bucket = event.bucket
+    s3_object_key = event.object_key
+    query_params = [
+        ("s3_object_key", s3_object_key),
+        ("s3_bucket", s3_bucket),
+    ]
+    query = get_mediahaven_query(query_params, or_params=False)
+    result = search_mediahaven(mediahaven_client, query, query_params)
+
+    # In one pass, collect the Media ID (and Fragment ID) of the fragments and
+    # get the Fragment ID of the essence to delete. The Media IDs of the fragments
+    # will be used to remove the collaterals.
+    fragments = {}
+    fragment_id_essence = None
+    media_id_essence = None
+    if result.nr_of_results:
+        for item in result.as_generator():
+            if item.Internal.IsFragment:
+                fragments[item.Dynamic.dc_identifier_localid] = item.Internal.FragmentId
+            elif fragment_id_essence is None:
+                fragment_id_essence = item.Internal.FragmentId
+                media_id_essence = _get_record_field(
+                    item, "Dynamic", "dc_identifier_localid"
+                )
+
+    if fragment_id_essence is None:
+        log.info(
+            f"No media object found with s3 bucket: {s3_bucket} and object key: {s3_object_key}"
+        )
+        return None
+
+    fragments_collateral = []
+    if fragments:
+        fragments_collateral = search_collaterals(
+            mediahaven_client, fragments.keys(), ctx
+        )
+
+    return RemovalPlan(
+        s3_bucket,
+        s3_object_key,
         fragment_id_essence,
-        f's3 delete-object for bucket: "{s3_bucket}" and key: "{s3_object_key}"',
+        fragments,
+        fragments_collateral,
+        media_id_essence,
+    )
+
+
+def plan_removals(
+    events: List[S3Event], mediahaven_client: MediaHaven, ctx: Context
+) -> list:
+    """Plan the removal of a batch of objects with combined queries.
+
+    One query finds the essences and fragments of all the objects, one query
+    finds the collaterals of all those fragments. The results are mapped back
+    to the objects via their S3 bucket and object key. If a result can't be
+    mapped back, every object is planned on its own.
+
+    Returns:
+        list -- Per event, the result of `plan_removal`.
+    """
+    if len(events) == 1:
+        return [plan_removal(events[0], mediahaven_client, ctx)]
+
+    keys = [("s3_object_key", event.object_key) for event in events]
+    buckets = [("s3_bucket", event.bucket) for event in events]
+    query = " ".join(
+        (
+            get_mediahaven_query(list(dict.fromkeys(keys))),
+            get_mediahaven_query(list(dict.fromkeys(buckets))),
+        )
+    )
+    result = search_mediahaven(mediahaven_client, query, keys + buckets)
+
+    # Group the essences and fragments by S3 bucket and object key
+    resolved = {
+        (event.bucket, event.object_key): [None, {}, None] for event in events
+    }
+    for item in result.as_generator():
+        s3_bucket = _get_record_field(item, "Dynamic", "s3_bucket")
+        s3_object_key = _get_record_field(item, "Dynamic", "s3_object_key")
+        if (s3_bucket, s3_object_key) not in resolved:
+            log.debug("Unable to map the batched results, planning one by one.")
+            return [plan_removal(event, mediahaven_client, ctx) for event in events]
+        essence_and_fragments = resolved[(s3_bucket, s3_object_key)]
+        if item.Internal.IsFragment:
+            essence_and_fragments[1][
+                item.Dynamic.dc_identifier_localid
+            ] = item.Internal.FragmentId
+        elif essence_and_fragments[0] is None:
+            essence_and_fragments[0] = item.Internal.FragmentId
+            essence_and_fragments[2] = _get_record_field(
+                item, "Dynamic", "dc_identifier_localid"
+            )
+
+    # Find the collaterals of all the fragments at once
+    media_ids = [
+        media_id
+        for _, fragments, _ in resolved.values()
+        for media_id in fragments.keys()
+    ]
+    collaterals = {}
+    if media_ids:
+        for fragment_id, media_id in search_collaterals(
+            mediahaven_client, media_ids, ctx
+        ):
+            collaterals.setdefault(media_id, []).append((fragment_id, media_id))
+
+    results = []
+    for event in events:
+        fragment_id_essence, fragments, media_id_essence = resolved[
+            (event.bucket, event.object_key)
+        ]
+        if fragment_id_essence is None:
+            log.info(
+                f"No media object found with s3 bucket: {event.bucket} and object key: {event.object_key}"
+            )
+            results.append(None)
+            continue
+        fragments_collateral = [
+            collateral
+            for media_id in fragments.keys()
+            for collateral in collaterals.get(media_id, [])
+        ]
+        results.append(
+            RemovalPlan(
+                event.bucket,
+                event.object_key,
+                fragment_id_essence,
+                fragments,
+                fragments_collateral,
+                media_id_essence,
+            )
+        )
+    return results
+
+
+def get_remove_batcher(ctx: Context, mediahaven_client: MediaHaven):
+    """Return the batcher of the removed events.
+
+    Returns None if batching is disabled, i.e. a batch size of 1.
+    """
+    mediahaven_config = ctx.config.app_cfg["mediahaven-api"]
+    batch_size = int(mediahaven_config.get("remove_batch_size", 1))
+    if batch_size <= 1:
+        return None
+    if ctx.remove_batcher is None:
+        ctx.remove_batcher = MicroBatcher(
+            lambda events: plan_removals(events, mediahaven_client, ctx),
+            batch_size,
+            int(mediahaven_config.get("remove_batch_wait_ms", 200)) / 1000,
+        )
+    return ctx.remove_batcher
+
+
+def handle_remove_event(
+    event: S3Event, properties, ctx: Context, mediahaven_client: MediaHaven
+) -> bool:
+    """Handler for s3 removed events
+
+    First we query MH with the s3_object_key and s3_bucket
+
+    This results in the main object (= essence) and its real fragments.
+    The real fragments potentially have collaterals linked that need to be deleted.
+    So we query all the objects with the media ID of the fragments.
+    Of those we filter out the real fragments. We should end up with only the
+    collaterals. These will be deleted concurrently. Finally, delete the essence.
+
+    In batch mode, removed events arriving within a short window are resolved
+    together with combined queries. The deletes are still done per event.
+    """
+
+    record = lookup_event(ctx, event)
+    if record is not None and record.outcome == DONE:
+        log.info("Event already handled, skipping.", s3_object_key=event.object_key)
+        return
+
+    # Get cp_name for or_id
+    cp_name = get_cp_name(event.tenant, ctx)
+
+    batcher = get_remove_batcher(ctx, mediahaven_client)
+    if batcher:
+        plan = batcher.submit(event)
+    else:
+        plan = plan_removal(event, mediahaven_client, ctx)
+    if plan is None:
+        remember_event(ctx, event, DONE)
+        return
+
+    log.info(
+        f"Removing media object with s3 bucket: {plan.s3_bucket} and object key: {plan.s3_object_key}",
+        **plan.summary(),
     )
+    execute_removal_plan(plan, mediahaven_client, ctx)
+    remember_event(ctx, event, DONE)
+
+
+def execute_removal_plan(
+    plan: RemovalPlan, mediahaven_client: MediaHaven, ctx: Context
+):
+    """Delete the collaterals of the plan, and then its essence."""
+    # The cached items of the collaterals are no longer valid
+    for media_id in plan.media_ids():
+        media_items.invalidate(media_id)
+
+    try:
+        deletions = plan.collateral_deletions()
+        if deletions:
+            # Delete the collaterals
+            failures = delete_media_objects(mediahaven_client, deletions, ctx)
+            if failures:
+                # Keep the essence so that a retry still finds the remaining
+                # collaterals
+                for _, error in failures:
+                    log.error(error.message, **error.kwargs)
+                raise NackException(
+                    f"Failed to delete {len(failures)} of {len(deletions)} collaterals",
+                    requeue=any(error.requeue for _, error in failures),
+                    fragment_ids=[fragment_id for fragment_id, _ in failures],
+                )
+
+        # Delete the essence
+        get_delete_limiter(ctx).acquire()
+        delete_media_object(mediahaven_client, *plan.essence_deletion())
+    finally:
+        # A concurrent collateral create might have cached them again
+        for media_id in plan.media_ids():
+            media_items.invalidate(media_id)
+
+
+def ensure_mediahaven_token(ctx: Context):
+    """Make sure the MediaHaven token is not about to expire.
+
+    Normally the token is refreshed in the background. This is a safety net
+    for when that didn't happen in time.
+    """
+    if ctx.token_manager is None:
+        return
+    try:
+        ctx.token_manager.ensure_fresh()
+    except (RequestTokenError, RequestException) as error:
+        raise NackException(
+            "Unable to refresh the MediaHaven token, retrying...",
+            error=error,
+            requeue=True,
+        )
+
+
+def parse_event(body):
+    """Parse the body of a message into an S3 event.
+
+    Returns:
+        S3Event -- The event, or the error if the body is not a valid event.
+    """
+    try:
+        return S3Event.from_dict(json.loads(body))
+    except (json.JSONDecodeError, InvalidEventException) as error:
+        return error
 
 
-def calculate_handler(event: dict):
+def event_key(event) -> Tuple[str, str]:
+    """The key by which the events of the same S3 object are kept in order.
+
+    Returns:
+        Tuple[str, str] -- The bucket and object key, or None if the message
+            is not a valid event.
+    """
+    if not isinstance(event, S3Event):
+        return None
+    return event.bucket, event.object_key
+
+
+def calculate_handler(event: S3Event):
     """Factory method to return correct handler"""
-    event_name = get_from_event(event, "event_name")
+    event_name = event.event_name
     base_type = event_name.split(":")[0]
     if base_type == "ObjectCreated":
         return handle_create_event
     elif base_type == "ObjectRemoved":
         return handle_remove_event
     else:
-        raise NackException(f"Unknown type of s3 event: {event_name}", s3_event=event)
+        raise NackException(
+            f"Unknown type of s3 event: {event_name}", s3_event=event._asdict()
+        )
 
 
-def callback(ch, method, properties, body, ctx, mediahaven_client):
-    try:
-        event = json.loads(body)
-        is_event_valid(event)
-    except (json.JSONDecodeError, InvalidEventException) as error:
-        log.warning("Bad s3 event.", error=str(error))
+def callback(ch, method, properties, body, ctx, mediahaven_client, event=None):
+    # The event might be parsed already, see `parse_event`
+    if event is None:
+        event = parse_event(body)
+    if not isinstance(event, S3Event):
+        log.warning("Bad s3 event.", error=str(event))
         ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
         return
 
+    # Keep the events of an S3 object in order: an event of which the retry
+    # is pending must not be overtaken by the later events of its object
+    pending_retries = get_pending_retries(ctx)
+    key = event_key(event)
+    fingerprint = event_fingerprint(event)
+    pending = pending_retries.get(key)
+    if pending is not None and pending[0] != fingerprint:
+        log.info(
+            "Deferring event behind an earlier event that awaits a retry.",
+            s3_object_key=event.object_key,
+        )
+        defer_event(ch, method, properties, body, ctx, pending[1])
+        return
+
     try:
+        ensure_mediahaven_token(ctx)
         handler = calculate_handler(event)
         handler(event, properties, ctx, mediahaven_client)
     except NackException as error:
-        handle_nack_exception(error, ch, method.delivery_tag)
+        delay = handle_nack_exception(error, ch, method, properties, body, ctx)
+        if delay is None:
+            pending_retries.discard(key, fingerprint)
+        else:
+            pending_retries.add(key, fingerprint, delay)
+        return
+    except CircuitOpenError as error:
+        # A dependency is down: put the event back and stop consuming until
+        # its circuit breaker lets a trial call through
+        log.warning("Pausing consumption.", error=str(error))
+        if ctx.consumer is not None:
+            ctx.consumer.pause(error.retry_in)
+        pending_retries.add(key, fingerprint, 0, wait=error.retry_in)
+        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
         return
 
+    pending_retries.discard(key, fingerprint)
     ch.basic_ack(delivery_tag=method.delivery_tag)
 
 
-def main(ctx: Context):
-    events = Events(ctx.config.app_cfg["rabbitmq"]["incoming"], ctx)
-    channel = events.get_channel()
+def set_up(ctx: Context) -> MediaHaven:
+    """Set up the long-lived resources that are shared by the handlers.
+
+    The publisher should be set up already.
+
+    Returns:
+        MediaHaven -- The MediaHaven client.
+    """
+    get_delayed_retry(ctx)
+    idempotency_config = ctx.config.app_cfg.get("idempotency", {})
+    if idempotency_config.get("enabled", False):
+        ctx.idempotency_store = IdempotencyStore(
+            idempotency_config["path"], ttl=int(idempotency_config.get("ttl", 604800))
+        )
+    ctx.ftp_pool = FTPPool(ctx)
+    ctx.pid_pool = PIDPool(ctx)
+    ctx.pid_pool.refill_async()
+    if ctx.config.app_cfg["organisations-api"].get("warm_up", False):
+        warm_up_cp_names(ctx)
     mediahaven_config = ctx.config.app_cfg["mediahaven-api"]
     client_id = mediahaven_config["client_id"]
     client_secret = mediahaven_config["client_secret"]
@@ -611,30 +1351,116 @@ def main(ctx: Context):
     password = mediahaven_config["passwd"]
     url = mediahaven_config["host"]
     grant = ROPCGrant(url, client_id, client_secret)
+    ctx.token_manager = TokenManager(
+        grant_fetcher(grant, user, password),
+        refresh_margin=int(mediahaven_config.get("token_refresh_margin", 60)),
+        default_expires_in=int(mediahaven_config.get("token_expires_in", 3600)),
+    )
     try:
-        grant.request_token(user, password)
+        ctx.token_manager.start()
     except RequestTokenError as e:
         log.error(e)
         raise e
     mediahaven_client = MediaHaven(url, grant)
+    # Adapt the rate of the calls to MediaHaven to its throttling, and stop
+    # calling it while it is down
+    mediahaven_client.records = get_circuit_breaker(ctx, "mediahaven-api").wrap(
+        ThrottledResource(
+            mediahaven_client.records,
+            get_mediahaven_limiter(ctx),
+            max_attempts=int(mediahaven_config.get("throttle_attempts", 3)),
+        )
+    )
+    return mediahaven_client
+
+
+def main(ctx: Context):
+    # Validate the destinations before consuming
+    destination_config.load()
+
+    # Amount of events that are handled concurrently
+    workers = int(ctx.config.app_cfg.get("consumer", {}).get("workers", 1))
+    events = Events(
+        ctx.config.app_cfg["rabbitmq"]["incoming"], ctx, prefetch_count=workers
+    )
+    channel = events.get_channel()
+    # The publisher shares the connection of the consumer, on its own channel
+    ctx.publisher = Publisher(
+        ctx.config.app_cfg["rabbitmq"]["outgoing"], ctx, connection=events.connection
+    )
+    mediahaven_client = set_up(ctx)
+
+    # Adapt callback fn to add in the ctx parameter
+    on_message_callback = lambda ch, method, properties, body, event=None: callback(
+        ch, method, properties, body, ctx, mediahaven_client, event
+    )
+    pool = None
+    if workers > 1:
+        # Events of the same S3 object are handled in order. The events are
+        # parsed once, to get their key.
+        pool = WorkerPool(
+            events.connection,
+            workers,
+            on_message_callback,
+            parse=parse_event,
+            key=event_key,
+        )
+        on_message_callback = pool.dispatch
 
-    consumer_tag = channel.basic_consume(
-        queue=events.queue,
-        # Adapt callback fn to add in the ctx parameter
-        on_message_callback=lambda ch, method, properties, body: callback(
-            ch, method, properties, body, ctx, mediahaven_client
-        ),
+    ctx.consumer = Consumer(
+        events.connection, channel, events.queue, on_message_callback
     )
+    consumer_tag = ctx.consumer.start()
+    # Stop consuming on SIGTERM, and let the events in flight finish
+    signal.signal(signal.SIGTERM, lambda signum, frame: ctx.consumer.stop())
 
     log.info(f"Starting: listening for messages on q:{events.queue}.")
     log.info(f"Starting: consumer tag is: {consumer_tag}.")
-    channel.start_consuming()
+    log.info(f"Starting: handling {workers} event(s) concurrently.")
+    try:
+        ctx.consumer.run()
+    finally:
+        if pool:
+            # Let in-flight events finish and flush their acks
+            pool.drain()
+
+
+def run():
+    """Run a consumer."""
+    main(Context(config))
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    """Parse the command line arguments.
+
+    Several consumer processes each get their share of the events, so the
+    events of an S3 object can be handled concurrently, in different
+    processes. Unless `consumer.ordered` is off, only one process is allowed.
+    """
+    parser = argparse.ArgumentParser(description="Handle the S3 events.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="amount of consumer processes to pre-fork (default: 1)",
+    )
+    args = parser.parse_args(argv)
+    ordered = config.app_cfg.get("consumer", {}).get("ordered", True)
+    if args.workers > 1 and ordered:
+        parser.error(
+            "--workers can't keep the events of an S3 object in order, "
+            "set consumer.ordered to false to allow it"
+        )
+    return args
 
 
 if __name__ == "__main__":
-    ctx = Context(config)
+    args = parse_args()
 
-    main(ctx)
+    if args.workers > 1:
+        Supervisor(run, args.workers).run()
+    else:
+        run()
 
 
 # vim modeline
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  meemoo/batching.py
+#
+#  Copyleft 2026 meemoo
+#
+
+# System imports
+import threading
+
+# Third-party imports
+
+# Local imports
+
+
+class _Batch(object):
+    def __init__(self):
+        self.items = []
+        self.results = None
+        self.error = None
+        self.timer = None
+        self.done = threading.Event()
+
+    def result(self, index):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.results[index]
+
+
+class MicroBatcher(object):
+    """Gather items submitted by concurrent threads into batches.
+
+    A batch is flushed when it holds `max_size` items, or `max_wait` seconds
+    after its first item got submitted. `flush` is called with the list of
+    items and must return a list with a result per item. Every submitting
+    thread blocks until its batch is flushed and gets the result for its own
+    item. If `flush` raises, the error is raised in every submitting thread.
+    """
+
+    def __init__(self, flush, max_size, max_wait):
+        self.flush = flush
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self.current = None
+        self.lock = threading.Lock()
+
+    def submit(self, item):
+        with self.lock:
+            batch = self.current
+            if batch is None:
+                batch = self.current = _Batch()
+                batch.timer = threading.Timer(self.max_wait, self._on_timer, (batch,))
+                batch.timer.daemon = True
+                batch.timer.start()
+            index = len(batch.items)
+            batch.items.append(item)
+            full = len(batch.items) >= self.max_size
+            if full:
+                self.current = None
+                batch.timer.cancel()
+        if full:
+            self._run(batch)
+        return batch.result(index)
+
+    def _on_timer(self, batch):
+        with self.lock:
+            if self.current is not batch:
+                # Already flushed because it was full
+                return
+            self.current = None
+        self._run(batch)
+
+    def _run(self, batch):
+        try:
+            batch.results = self.flush(batch.items)
+        except Exception as e:
+            batch.error = e
+        finally:
+            batch.done.set()
+
+
+# vim modeline
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
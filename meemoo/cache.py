@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  meemoo/cache.py
+#
+#  Copyleft 2026 meemoo
+#
+
+# System imports
+import collections
+import threading
+import time
+from concurrent.futures import Future
+
+# Third-party imports
+from viaa.configuration import ConfigParser
+from viaa.observability import logging
+
+# Local imports
+
+# Get logger
+config = ConfigParser()
+log = logging.get_logger(__name__, config=config)
+
+
+class _Entry(object):
+    __slots__ = ("value", "error", "expires_at", "refresh_at")
+
+    def __init__(self, value=None, error=None, ttl=0, refresh_ahead=1.0):
+        now = time.monotonic()
+        self.value = value
+        self.error = error
+        self.expires_at = now + ttl
+        # Negative entries are never refreshed, they just expire
+        self.refresh_at = self.expires_at
+        if error is None:
+            self.refresh_at = now + ttl * refresh_ahead
+
+    def result(self):
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class TTLCache(object):
+    """Thread-safe cache with a TTL per entry and an LRU bound on its size.
+
+    Values are loaded with the `loader` passed to `get`:
+    - Concurrent lookups of the same missing key result in a single load.
+    - A hit on an entry that is past `refresh_ahead` (a fraction of the TTL)
+      triggers a refresh in the background, while still returning the current
+      value.
+    - Errors of type `negative_exceptions` are cached for `negative_ttl`
+      seconds and re-raised on every lookup. Other errors are not cached.
+    """
+
+    def __init__(
+        self,
+        maxsize=1024,
+        ttl=3600,
+        negative_ttl=60,
+        refresh_ahead=0.8,
+        negative_exceptions=(),
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.refresh_ahead = refresh_ahead
+        self.negative_exceptions = tuple(negative_exceptions)
+        self.entries = collections.OrderedDict()
+        self.loading = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, loader):
+        """Return the value for `key`, loading it with `loader(key)` if needed."""
+        now = time.monotonic()
+        refresh = False
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.expires_at > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                if entry.refresh_at <= now and key not in self.loading:
+                    self.loading[key] = Future()
+                    refresh = True
+            else:
+                entry = None
+                self.misses += 1
+                future = self.loading.get(key)
+                owner = future is None
+                if owner:
+                    future = self.loading[key] = Future()
+
+        if entry is not None:
+            if refresh:
+                threading.Thread(
+                    target=self._load, args=(key, loader), daemon=True
+                ).start()
+            return entry.result()
+
+        if owner:
+            self._load(key, loader)
+        return future.result()
+
+    def _load(self, key, loader):
+        with self.lock:
+            future = self.loading[key]
+        try:
+            value = loader(key)
+        except self.negative_exceptions as e:
+            self._store(key, _Entry(error=e, ttl=self.negative_ttl))
+            future.set_exception(e)
+        except Exception as e:
+            with self.lock:
+                self.loading.pop(key, None)
+            future.set_exception(e)
+        else:
+            self._store(key, self._entry(value))
+            future.set_result(value)
+
+    def _entry(self, value):
+        return _Entry(value, ttl=self.ttl, refresh_ahead=self.refresh_ahead)
+
+    def _store(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+            self.loading.pop(key, None)
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self.entries),
+            }
+
+    def __contains__(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and entry.expires_at > time.monotonic()
+
+    def __getitem__(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None or entry.expires_at <= time.monotonic():
+            raise KeyError(key)
+        return entry.result()
+
+    def __setitem__(self, key, value):
+        self._store(key, self._entry(value))
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+
+# vim modeline
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
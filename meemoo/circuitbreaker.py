@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  meemoo/circuitbreaker.py
+#
+#  Copyleft 2026 meemoo
+#
+
+# System imports
+import ftplib
+import functools
+import threading
+import time
+
+# Third-party imports
+from viaa.configuration import ConfigParser
+from viaa.observability import logging
+
+# Local imports
+
+# Get logger
+config = ConfigParser()
+log = logging.get_logger(__name__, config=config)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+_lock = threading.Lock()
+
+
+class CircuitOpenError(Exception):
+    """Exception raised when a call is refused because the circuit is open."""
+
+    def __init__(self, name, retry_in):
+        self.name = name
+        self.retry_in = retry_in
+        super().__init__(f"Circuit for '{name}' is open, retry in {retry_in:.1f}s")
+
+
+def is_unavailable(error) -> bool:
+    """Whether the error means that the dependency is unavailable.
+
+    That is the case for connection errors and timeouts, server errors (5xx)
+    and temporary FTP errors. Other errors, e.g. a 404, mean that the
+    dependency did respond.
+    """
+    response = getattr(error, "response", None)
+    status_code = getattr(response, "status_code", None)
+    if status_code is None:
+        status_code = getattr(error, "status_code", None)
+    if isinstance(status_code, int):
+        return status_code >= 500
+    return isinstance(error, (OSError, EOFError, ftplib.error_temp))
+
+
+class CircuitBreaker(object):
+    """Thread-safe circuit breaker for a dependency.
+
+    - Closed: calls go through. After `failure_threshold` consecutive
+      failures, the circuit opens.
+    - Open: calls are refused with a `CircuitOpenError`. After
+      `reset_timeout` seconds, the circuit becomes half-open.
+    - Half-open: a single trial call goes through, the others are refused.
+      If it succeeds, the circuit closes, otherwise it opens again.
+
+    Only errors for which `is_failure` returns True count as failures.
+    """
+
+    def __init__(
+        self, name, failure_threshold=5, reset_timeout=30, is_failure=is_unavailable
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.is_failure = is_failure
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial = False
+        self.lock = threading.Lock()
+
+    def retry_in(self) -> float:
+        """Seconds until the circuit becomes half-open."""
+        with self.lock:
+            if self.state != OPEN:
+                return 0.0
+            return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def before_call(self):
+        """Raise a CircuitOpenError if the call is not allowed."""
+        with self.lock:
+            if self.state == OPEN:
+                retry_in = self.opened_at + self.reset_timeout - time.monotonic()
+                if retry_in > 0:
+                    raise CircuitOpenError(self.name, retry_in)
+                log.info(f"Circuit for '{self.name}' is half-open.")
+                self.state = HALF_OPEN
+                self.trial = False
+            if self.state == HALF_OPEN:
+                if self.trial:
+                    raise CircuitOpenError(self.name, self.reset_timeout)
+                self.trial = True
+
+    def record_success(self):
+        with self.lock:
+            if self.state != CLOSED:
+                log.info(f"Circuit for '{self.name}' is closed.")
+            self.state = CLOSED
+            self.failures = 0
+            self.trial = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    log.warning(
+                        f"Circuit for '{self.name}' is open.", failures=self.failures
+                    )
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.trial = False
+
+    def call(self, function, *args, **kwargs):
+        self.before_call()
+        try:
+            result = function(*args, **kwargs)
+        except Exception as e:
+            if self.is_failure(e):
+                self.record_failure()
+            else:
+                # The dependency did respond
+                self.record_success()
+            raise
+        self.record_success()
+        return result
+
+    def wrap(self, resource):
+        """Return a proxy of which every method call goes through the breaker."""
+        return _GuardedResource(resource, self)
+
+
+class _GuardedResource(object):
+    def __init__(self, resource, breaker):
+        self.resource = resource
+        self.breaker = breaker
+
+    def __getattr__(self, name):
+        attribute = getattr(self.resource, name)
+        if not callable(attribute):
+            return attribute
+        return functools.partial(self.breaker.call, attribute)
+
+
+def get_circuit_breaker(ctx, name) -> CircuitBreaker:
+    """The circuit breaker for the dependency `name`, shared per context.
+
+    The thresholds are configured in the `circuit-breakers` section.
+    """
+    with _lock:
+        if ctx.circuit_breakers is None:
+            ctx.circuit_breakers = {}
+        breaker = ctx.circuit_breakers.get(name)
+        if breaker is None:
+            breaker_config = ctx.config.app_cfg.get("circuit-breakers", {})
+            breaker = ctx.circuit_breakers[name] = CircuitBreaker(
+                name,
+                failure_threshold=int(breaker_config.get("failure_threshold", 5)),
+                reset_timeout=float(breaker_config.get("reset_timeout", 30)),
+            )
+    return breaker
+
+
+# vim modeline
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
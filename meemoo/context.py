@@ -24,6 +24,20 @@ class Context(object):
         self.correlation_id = "abc123"
         self.dryrun = not cfg.app_cfg.get("environment", "development") in ["production", "qas"]
         self.config = cfg
+        # Long-lived resources, set up once at startup
+        self.publisher = None
+        self.ftp_pool = None
+        self.pid_pool = None
+        self.delayed_retry = None
+        self.pending_retries = None
+        self.delete_limiter = None
+        self.ingest_check_batcher = None
+        self.remove_batcher = None
+        self.token_manager = None
+        self.mediahaven_limiter = None
+        self.circuit_breakers = None
+        self.consumer = None
+        self.idempotency_store = None
 
 
 # vim modeline
@@ -9,7 +9,11 @@
 #
 
 # System imports
+import functools
 import os
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
 
 # Third-party imports
 import pika
@@ -24,12 +28,14 @@ log = logging.get_logger(__name__, config=config)
 
 
 class Events(object):
-    def __init__(self, queue_info, ctx):
+    def __init__(self, queue_info, ctx, prefetch_count=1, connection=None):
         self.ctx = ctx
+        self.prefetch_count = prefetch_count
         self.queue = queue_info["queue"]
         self.exchange = queue_info["exchange"]
         self.credentials = self._init_credentials()
-        self.connection = self._init_connection()
+        # Reuse the given connection, but always open our own channel on it
+        self.connection = connection or self._init_connection()
         self.channel = self._init_channel()
         self._declare_queue()
 
@@ -52,7 +58,7 @@ class Events(object):
     def _init_channel(self):
         """"""
         channel = self.connection.channel()
-        channel.basic_qos(prefetch_count=1)
+        channel.basic_qos(prefetch_count=self.prefetch_count)
         return channel
 
     def _declare_queue(self):
@@ -91,5 +97,284 @@ class Events(object):
         return self.channel
 
 
+class Consumer(object):
+    """Consumes a queue, and can pause consuming for a while.
+
+    `pause` can be called from any thread. It cancels the consumer, so that
+    no more events get delivered, and `run` resumes consuming after the pause.
+    `stop` only sets a flag, so it is safe to call from a signal handler:
+    `run` then cancels the consumer and returns.
+    """
+
+    POLL_INTERVAL = 1
+
+    def __init__(self, connection, channel, queue, on_message_callback):
+        self.connection = connection
+        self.channel = channel
+        self.queue = queue
+        self.on_message_callback = on_message_callback
+        self.consumer_tag = None
+        self.resume_at = None
+        self.owner = None
+        self.stopped = False
+
+    def start(self):
+        self.owner = threading.get_ident()
+        self.resume_at = None
+        self.consumer_tag = self.channel.basic_consume(
+            queue=self.queue, on_message_callback=self.on_message_callback
+        )
+        return self.consumer_tag
+
+    def stop(self):
+        self.stopped = True
+
+    def pause(self, seconds):
+        if threading.get_ident() == self.owner:
+            self._pause(seconds)
+        else:
+            self.connection.add_callback_threadsafe(
+                functools.partial(self._pause, seconds)
+            )
+
+    def _pause(self, seconds):
+        if self.consumer_tag is None:
+            # Already paused
+            return
+        log.info(f"Pausing consumption for {seconds:.1f}s.")
+        self.channel.basic_cancel(self.consumer_tag)
+        self.consumer_tag = None
+        self.resume_at = time.monotonic() + seconds
+
+    def run(self):
+        """Consume until stopped, resuming after pauses."""
+        while not self.stopped:
+            if self.consumer_tag is None and time.monotonic() >= self.resume_at:
+                log.info("Resuming consumption.")
+                self.start()
+            # Also serves the connection (heartbeats, acks) while paused
+            self.connection.process_data_events(time_limit=self.POLL_INTERVAL)
+        if self.consumer_tag is not None:
+            self.channel.basic_cancel(self.consumer_tag)
+            self.consumer_tag = None
+
+
+class Publisher(object):
+    """Long-lived publisher for the outgoing messages.
+
+    The publisher is created once at startup. It publishes on its own channel
+    on the (shared) connection of the consumer and declares its topology only
+    once. When called from another thread than the one owning the shared
+    connection, the publish is marshalled to the connection thread with
+    `add_callback_threadsafe`, and waits at most `publish_timeout` seconds
+    for the connection thread to run it. When the connection or channel got
+    closed, it reopens them by itself.
+    """
+
+    def __init__(self, queue_info, ctx, connection=None):
+        self.ctx = ctx
+        self.timeout = float(queue_info.get("publish_timeout", 30))
+        self.shared = connection is not None
+        self.owner = threading.get_ident()
+        self.lock = threading.RLock()
+        self.events = Events(queue_info, ctx, connection=connection)
+
+    def publish(self, message, correlation_id):
+        self.run(lambda events: events.publish(message, correlation_id))
+
+    def run(self, fn):
+        """Run `fn(events)` with exclusive access to the publishing channel.
+
+        If needed, the call is marshalled to the thread owning the connection.
+        Connection or channel errors are retried once on a reopened channel.
+        Raises an AMQPError if the connection thread didn't run the call in
+        time, e.g. because the connection got closed in the meantime.
+        """
+        connection = self.events.connection
+        on_owner_thread = threading.get_ident() == self.owner
+        if self.shared and connection.is_open and not on_owner_thread:
+            future = Future()
+
+            def _run():
+                if not future.set_running_or_notify_cancel():
+                    # Timed out already
+                    return
+                try:
+                    future.set_result(self._run(fn))
+                except Exception as e:
+                    future.set_exception(e)
+
+            connection.add_callback_threadsafe(_run)
+            try:
+                return future.result(timeout=self.timeout)
+            except TimeoutError:
+                if not future.cancel():
+                    # It's running after all, let it finish
+                    return future.result()
+                raise pika.exceptions.AMQPError(
+                    f"Timed out after {self.timeout}s waiting for the connection"
+                )
+        return self._run(fn)
+
+    def _run(self, fn):
+        with self.lock:
+            self._ensure_open()
+            try:
+                return fn(self.events)
+            except pika.exceptions.AMQPError as e:
+                log.warning(
+                    f"Channel error for {self.events.exchange}, retrying.",
+                    error=str(e),
+                )
+                self._ensure_open()
+                return fn(self.events)
+
+    def _ensure_open(self):
+        """(Re)open the connection and/or channel if they got closed."""
+        if self.events.connection.is_closed:
+            log.info("Outgoing connection closed, reconnecting.")
+            # The shared connection is gone, from now on use our own
+            self.shared = False
+            self.events.connection = self.events._init_connection()
+            self.events.channel = self.events._init_channel()
+            self.events._declare_queue()
+        elif self.events.channel.is_closed:
+            log.info("Outgoing channel closed, reopening.")
+            self.events.channel = self.events._init_channel()
+
+    def close(self):
+        with self.lock:
+            if self.events.channel.is_open:
+                self.events.channel.close()
+            if not self.shared and self.events.connection.is_open:
+                self.events.connection.close()
+
+
+class DelayedRetry(object):
+    """Retry messages later via broker-side delay queues.
+
+    For every delay (in seconds) a durable queue is declared with a message
+    TTL. Expired messages get dead-lettered, via the default exchange, back
+    onto the consuming queue. A message to retry is published to the delay
+    queue of its tier, with its retry count in a header, and then acked. The
+    consumer thus never has to wait.
+    """
+
+    RETRY_HEADER = "x-retry-count"
+
+    def __init__(self, publisher, queue, delays, max_retries=0):
+        self.publisher = publisher
+        self.queue = queue
+        self.delays = [int(delay) for delay in delays]
+        # 0 means retry indefinitely, at the last tier
+        self.max_retries = int(max_retries)
+        self.publisher.run(self._declare_queues)
+
+    def retry_queue(self, delay):
+        return f"{self.queue}.retry.{delay}s"
+
+    def _declare_queues(self, events):
+        for delay in self.delays:
+            events.channel.queue_declare(
+                queue=self.retry_queue(delay),
+                durable=True,
+                arguments={
+                    "x-message-ttl": delay * 1000,
+                    "x-dead-letter-exchange": "",
+                    "x-dead-letter-routing-key": self.queue,
+                },
+            )
+
+    def schedule(self, channel, delivery_tag, properties, body):
+        """Publish the message to the delay queue of its tier and ack it.
+
+        Returns:
+            int -- The delay in seconds, or None if the maximum amount of
+            retries is reached. The message is then nacked without
+            requeueing.
+        """
+        headers = dict(getattr(properties, "headers", None) or {})
+        retry_count = int(headers.get(self.RETRY_HEADER, 0))
+        if self.max_retries and retry_count >= self.max_retries:
+            channel.basic_nack(delivery_tag=delivery_tag, requeue=False)
+            return None
+
+        delay = self.delays[min(retry_count, len(self.delays) - 1)]
+        headers[self.RETRY_HEADER] = retry_count + 1
+        log.debug(f"Retrying message in {delay}s, attempt {retry_count + 1}")
+        self._publish(delay, properties, headers, body)
+        channel.basic_ack(delivery_tag=delivery_tag)
+        return delay
+
+    def defer(self, channel, delivery_tag, properties, body, delay):
+        """Publish the message to the delay queue of `delay` and ack it.
+
+        Unlike `schedule`, this doesn't count as a retry of the message: it
+        is meant for messages that have to wait behind a retried message.
+        """
+        headers = dict(getattr(properties, "headers", None) or {})
+        log.debug(f"Deferring message by {delay}s")
+        self._publish(delay, properties, headers, body)
+        channel.basic_ack(delivery_tag=delivery_tag)
+
+    def _publish(self, delay, properties, headers, body):
+        retry_properties = pika.BasicProperties(
+            delivery_mode=2,
+            correlation_id=getattr(properties, "correlation_id", None),
+            headers=headers,
+        )
+        self.publisher.run(
+            lambda events: events.channel.basic_publish(
+                exchange="",
+                routing_key=self.retry_queue(delay),
+                body=body,
+                properties=retry_properties,
+            )
+        )
+
+
+class PendingRetries(object):
+    """Thread-safe register of the keys of which a message awaits a retry.
+
+    While a message is retried later, the later messages with the same key
+    have to wait behind it, or they would overtake it. Per key, it keeps
+    the message that awaits its retry and the delay queue it waits in, 0 if
+    it was requeued instead. An entry expires `grace` seconds after the
+    message should be back, in case it never comes back.
+    """
+
+    def __init__(self, grace=60):
+        self.grace = grace
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def add(self, key, message_id, delay, wait=None):
+        """Register that the message awaits a retry in `delay` seconds, or
+        after `wait` seconds if it was requeued (`delay` 0)."""
+        wait = delay if wait is None else wait
+        expires_at = time.monotonic() + wait + self.grace
+        with self.lock:
+            self.entries[key] = (message_id, delay, expires_at)
+
+    def get(self, key):
+        """The message ID and the delay of the message that awaits a retry,
+        or None."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[2] <= time.monotonic():
+                del self.entries[key]
+                return None
+            return entry[:2]
+
+    def discard(self, key, message_id):
+        """Forget the key, if it's the message that awaits the retry."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == message_id:
+                del self.entries[key]
+
+
 # vim modeline
 # vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
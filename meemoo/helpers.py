@@ -10,7 +10,11 @@
 
 # System imports
 import os
+import queue
+import threading
 from io import BytesIO
+from types import MappingProxyType
+from typing import NamedTuple
 from ftplib import FTP as BuiltinFTP
 from urllib.parse import urlparse
 import re
@@ -22,6 +26,7 @@ from lxml import etree
 import yaml
 
 # Local imports
+from meemoo.circuitbreaker import get_circuit_breaker
 
 
 # Get logger
@@ -41,17 +46,100 @@ class InvalidEventException(Exception):
         self.message = message
         self.kwargs = kwargs
 
+class DestinationConfig(object):
+    """The routing table of `destination_config.yml`.
+
+    The file is parsed once into an immutable lookup keyed by
+    (environment, cp_name, file_type). It is only parsed again, and swapped in
+    atomically, when the mtime of the file changes. If a changed file is
+    invalid, the previous table is kept.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.mtime = None
+        self.destinations = MappingProxyType({})
+        self.lock = threading.Lock()
+
+    def _get_path(self):
+        return self.path or os.getcwd() + "/destination_config.yml"
+
+    @staticmethod
+    def _parse(raw) -> MappingProxyType:
+        """Validate the parsed YAML and flatten it into the lookup table.
+
+        Raises `ValueError` upon an invalid structure.
+        """
+        destinations = {}
+        if raw is None:
+            return MappingProxyType(destinations)
+        if not isinstance(raw, dict):
+            raise ValueError("Expected a mapping of environments.")
+        for environment, cps in raw.items():
+            if not isinstance(cps, dict):
+                raise ValueError(f"Expected a mapping of CPs for '{environment}'.")
+            for cp_name, file_types in cps.items():
+                if not isinstance(file_types, dict):
+                    raise ValueError(
+                        f"Expected a mapping of file types for '{cp_name}' in '{environment}'."
+                    )
+                for file_type, destination in file_types.items():
+                    if not isinstance(destination, str):
+                        raise ValueError(
+                            f"Invalid destination for '{cp_name}' with type '{file_type}' in '{environment}'."
+                        )
+                    destinations[(environment, cp_name, file_type)] = destination
+        return MappingProxyType(destinations)
+
+    def load(self):
+        """Parse the file if it changed since the last load.
+
+        Raises upon a missing or invalid file.
+        """
+        path = self._get_path()
+        mtime = os.stat(path).st_mtime_ns
+        if mtime == self.mtime:
+            return
+        with self.lock:
+            if mtime == self.mtime:
+                return
+            try:
+                with open(path, "r") as ymlfile:
+                    raw = yaml.load(ymlfile, Loader=yaml.FullLoader)
+                self.destinations = self._parse(raw)
+            except (yaml.YAMLError, ValueError):
+                if self.mtime is not None:
+                    # Don't parse the invalid file again until it changes
+                    self.mtime = mtime
+                raise
+            self.mtime = mtime
+            log.info(f"Loaded {len(self.destinations)} destinations from {path}")
+
+    def get(self, environment: str, cp_name: str, file_type: str):
+        try:
+            self.load()
+        except (OSError, yaml.YAMLError, ValueError) as error:
+            if self.mtime is None:
+                raise error
+            log.error(
+                "Failed to reload the destinations, keeping the previous ones.",
+                error=str(error),
+            )
+        return self.destinations.get((environment, cp_name, file_type))
+
+
+destination_config = DestinationConfig()
+
+
 def get_destination_for_cp(environment: str, cp_name: str, file_type: str):
     # Default location
     destination = "DISK-SHARE-EVENTS"
 
-    with open(os.getcwd() + "/destination_config.yml", "r") as ymlfile:
-        destinations = yaml.load(ymlfile, Loader=yaml.FullLoader)
-    
-    try:
-        destination = destinations[environment][cp_name][file_type]
-    except KeyError as ke:
+    configured = destination_config.get(environment, cp_name, file_type)
+    if configured is None:
         log.info(f"No destination configured for content partner '{cp_name}' with type '{file_type}' in '{environment}'")
+    else:
+        destination = configured
 
     return destination
 
@@ -109,12 +197,55 @@ def normalize_or_id(or_id):
     return '-'.join((prefix.upper(), noid.lower()))
 
 def is_event_valid(event):
-    try:
-        fields_present_in_event = [field for field in S3_FIELDS if get_from_event(event, field)]
-        
-        assert set(REQUIRED_S3_FIELDS).issubset(set(fields_present_in_event))
-    except (AssertionError, KeyError, ValueError, InvalidEventException) as error:
-        raise InvalidEventException("Not all fields are present in the event.", event=event, error=error)
+    S3Event.from_dict(event)
+
+
+class S3Event(NamedTuple):
+    """The fields of an S3 event that we need, parsed once.
+
+    Immutable and without a per-instance `__dict__`. Build it with `from_dict`,
+    which validates and normalises every field in a single pass.
+    """
+
+    bucket: str
+    object_key: str
+    domain: str
+    tenant: str
+    user: str
+    md5: str
+    event_name: str
+
+    @classmethod
+    def from_dict(cls, event: dict) -> "S3Event":
+        """Parse the (JSON-decoded) S3 event.
+
+        Raises `InvalidEventException` if not all required fields are present.
+        """
+        try:
+            record = event["Records"][0]
+            s3 = record["s3"]
+            s3_event = cls(
+                bucket=s3["bucket"]["name"],
+                object_key=s3["object"]["key"],
+                domain=s3["domain"]["name"],
+                tenant=normalize_or_id(s3["bucket"]["metadata"]["tenant"]),
+                user=record["userIdentity"]["principalId"],
+                md5=try_to_find_md5(s3["object"]["metadata"]),
+                event_name=record["eventName"],
+            )
+            assert all(getattr(s3_event, field) for field in REQUIRED_S3_FIELDS)
+        except (
+            AssertionError,
+            AttributeError,
+            IndexError,
+            KeyError,
+            TypeError,
+            ValueError,
+        ) as error:
+            raise InvalidEventException(
+                "Not all fields are present in the event.", event=event, error=error
+            )
+        return s3_event
 
 
 class SidecarBuilder(object):
@@ -190,12 +321,18 @@ class SidecarBuilder(object):
 
 
 class FTP(object):
-    """Abstraction for FTP"""
+    """Abstraction for FTP
+
+    Holds a single authenticated session to the transport server. The session
+    stays open after a `put` and remembers its current directory, so that it
+    can be reused for subsequent transfers.
+    """
 
     def __init__(self, ctx=None):
         self.ctx = ctx
         self.host = self.__set_host()
         self.conn = self.__connect()
+        self.cwd = None
 
     #
 
@@ -210,9 +347,12 @@ class FTP(object):
         config = self.ctx.config.app_cfg
         ftp_user = config["mediahaven"]["ftp"]["user"]
         ftp_passwd = config["mediahaven"]["ftp"]["passwd"]
+        timeout = config["mediahaven"]["ftp"].get("timeout", 30)
 
         try:
-            conn = BuiltinFTP(host=self.host, user=ftp_user, passwd=ftp_passwd)
+            conn = BuiltinFTP(
+                host=self.host, user=ftp_user, passwd=ftp_passwd, timeout=timeout
+            )
         except Exception as e:
             log.error(e)
             raise e
@@ -220,18 +360,110 @@ class FTP(object):
             log.debug(f"Succesfully established connection to {self.host}")
             return conn
 
+    def is_alive(self) -> bool:
+        """Check if the session is still usable by sending a NOOP."""
+        try:
+            self.conn.voidcmd("NOOP")
+        except Exception:
+            return False
+        return True
+
     def put(self, content_bytes, destination_path, destination_filename):
         log.debug(
             f"Putting {destination_filename} to {destination_path} on {self.host}"
         )
-        with self.conn as conn:
+        try:
+            # Skip the cwd if we are already in the destination folder
+            if self.cwd != destination_path:
+                self.conn.cwd(destination_path)
+                self.cwd = destination_path
+            stor_cmd = f"STOR {destination_filename}"
+            self.conn.storbinary(stor_cmd, BytesIO(content_bytes))
+        except Exception as e:
+            self.cwd = None
+            log.critical(f"Failed to put sidecar on {self.host} {destination_path}")
+            raise e
+
+    def close(self):
+        try:
+            self.conn.quit()
+        except Exception:
+            self.conn.close()
+
+
+class FTPPool(object):
+    """Pool of authenticated FTP sessions to the transport server.
+
+    Idle sessions are kept alive and checked with a NOOP before reuse. Stale
+    sessions are dropped and replaced by a new one. At most `size` sessions
+    are open at the same time.
+    """
+
+    def __init__(self, ctx=None, size=None):
+        self.ctx = ctx
+        if size is None:
+            size = ctx.config.app_cfg["mediahaven"]["ftp"].get("pool_size", 2)
+        self.size = int(size)
+        self.sessions = queue.LifoQueue(maxsize=self.size)
+        self.slots = threading.BoundedSemaphore(self.size)
+
+    def _checkout(self):
+        """Return an idle session if one is still alive, otherwise a new one.
+
+        Returns:
+            Tuple[FTP, bool] -- The session and if it is reused.
+        """
+        while True:
+            try:
+                session = self.sessions.get_nowait()
+            except queue.Empty:
+                return FTP(self.ctx), False
+            if session.is_alive():
+                return session, True
+            log.debug(f"Dropping stale FTP session to {session.host}")
+            session.close()
+
+    def _checkin(self, session):
+        try:
+            self.sessions.put_nowait(session)
+        except queue.Full:
+            session.close()
+
+    def put(self, content_bytes, destination_path, destination_filename):
+        """Put the content on the transport server, through the circuit
+        breaker of the FTP server."""
+        get_circuit_breaker(self.ctx, "ftp").call(
+            self._put, content_bytes, destination_path, destination_filename
+        )
+
+    def _put(self, content_bytes, destination_path, destination_filename):
+        with self.slots:
+            session, reused = self._checkout()
             try:
-                conn.cwd(destination_path)
-                stor_cmd = f"STOR {destination_filename}"
-                conn.storbinary(stor_cmd, BytesIO(content_bytes))
+                session.put(content_bytes, destination_path, destination_filename)
             except Exception as e:
-                log.critical(f"Failed to put sidecar on {self.host} {destination_path}")
-                raise e
+                session.close()
+                if not reused:
+                    raise e
+                # The session went stale in between, retry once on a new one
+                log.debug("Retrying put on a new FTP session", error=str(e))
+                session = FTP(self.ctx)
+                try:
+                    session.put(
+                        content_bytes, destination_path, destination_filename
+                    )
+                except Exception as e:
+                    session.close()
+                    raise e
+            self._checkin(session)
+
+    def close(self):
+        while True:
+            try:
+                session = self.sessions.get_nowait()
+            except queue.Empty:
+                return
+            session.close()
 
 
 # vim modeline
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  meemoo/idempotency.py
+#
+#  Copyleft 2026 meemoo
+#
+
+# System imports
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import NamedTuple
+
+# Third-party imports
+from viaa.configuration import ConfigParser
+from viaa.observability import logging
+
+# Local imports
+
+# Get logger
+config = ConfigParser()
+log = logging.get_logger(__name__, config=config)
+
+# The outcome of an event
+DONE = "done"
+
+
+def event_fingerprint(event) -> str:
+    """Fingerprint of an S3 event: the same for every delivery of the event."""
+    parts = (event.event_name, event.bucket, event.object_key, event.md5 or "")
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class EventRecord(NamedTuple):
+    outcome: str
+    data: dict
+
+
+class Checkpoint(NamedTuple):
+    """The finished steps of an unfinished create event."""
+
+    pid: str = None
+    sidecar: bytes = None
+    dest_path: str = None
+    dest_filename: str = None
+    # Collaterals only: the fragment of the item to link the collateral to
+    fragment_id: str = None
+    fragment_updated: bool = False
+    transferred: bool = False
+    # The transfer request might have been published
+    publishing: bool = False
+
+
+class IdempotencyStore(object):
+    """Embedded SQLite store of the outcomes of the handled events.
+
+    Records expire after `ttl` seconds. Only the latest event of an S3
+    object is kept: recording an event forgets the other events of the same
+    bucket and object key, so that e.g. a re-upload after a removal is not
+    mistaken for a duplicate.
+
+    It also holds the journal of the create events that are in progress,
+    keyed by bucket, object key and md5. A retry resumes from the checkpoint
+    of the earlier attempt. Recording an event as done clears the journal of
+    its object.
+
+    The store is thread-safe. The connection is opened on first use, so that
+    every (forked) process opens its own. The store is best-effort: errors
+    are logged and then treated as a miss.
+    """
+
+    def __init__(self, path, ttl=604800):
+        self.path = path
+        self.ttl = ttl
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        if self.connection is None:
+            connection = sqlite3.connect(
+                self.path, check_same_thread=False, isolation_level=None
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                """CREATE TABLE IF NOT EXISTS events (
+                    fingerprint TEXT PRIMARY KEY,
+                    bucket TEXT NOT NULL,
+                    object_key TEXT NOT NULL,
+                    outcome TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )"""
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS events_object "
+                "ON events (bucket, object_key)"
+            )
+            connection.execute(
+                """CREATE TABLE IF NOT EXISTS journal (
+                    bucket TEXT NOT NULL,
+                    object_key TEXT NOT NULL,
+                    md5 TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    sidecar BLOB,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (bucket, object_key, md5)
+                )"""
+            )
+            for table in ("events", "journal"):
+                connection.execute(
+                    f"DELETE FROM {table} WHERE expires_at <= ?", (time.time(),)
+                )
+            self.connection = connection
+        return self.connection
+
+    def get(self, fingerprint) -> EventRecord:
+        """The record of the event, or None if it's unknown or expired."""
+        try:
+            with self.lock:
+                row = (
+                    self._connect()
+                    .execute(
+                        "SELECT outcome, data FROM events "
+                        "WHERE fingerprint = ? AND expires_at > ?",
+                        (fingerprint, time.time()),
+                    )
+                    .fetchone()
+                )
+        except sqlite3.Error as e:
+            log.warning("Failed to look up the event.", error=str(e))
+            return None
+        if row is None:
+            return None
+        return EventRecord(row[0], json.loads(row[1]))
+
+    def record(self, fingerprint, bucket, object_key, outcome, **data):
+        """Record the outcome of the event."""
+        try:
+            with self.lock:
+                connection = self._connect()
+                with connection:
+                    connection.execute("BEGIN")
+                    connection.execute(
+                        "DELETE FROM events WHERE bucket = ? AND object_key = ? "
+                        "AND fingerprint != ?",
+                        (bucket, object_key, fingerprint),
+                    )
+                    connection.execute(
+                        "INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?)",
+                        (
+                            fingerprint,
+                            bucket,
+                            object_key,
+                            outcome,
+                            json.dumps(data),
+                            time.time() + self.ttl,
+                        ),
+                    )
+                    if outcome == DONE:
+                        connection.execute(
+                            "DELETE FROM journal WHERE bucket = ? AND object_key = ?",
+                            (bucket, object_key),
+                        )
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            log.warning("Failed to record the event.", error=str(e))
+
+    def get_checkpoint(self, bucket, object_key, md5) -> Checkpoint:
+        """The checkpoint of the create event, empty if there is none."""
+        try:
+            with self.lock:
+                row = (
+                    self._connect()
+                    .execute(
+                        "SELECT data, sidecar FROM journal WHERE bucket = ? "
+                        "AND object_key = ? AND md5 = ? AND expires_at > ?",
+                        (bucket, object_key, md5, time.time()),
+                    )
+                    .fetchone()
+                )
+        except sqlite3.Error as e:
+            log.warning("Failed to look up the checkpoint.", error=str(e))
+            return Checkpoint()
+        if row is None:
+            return Checkpoint()
+        sidecar = bytes(row[1]) if row[1] is not None else None
+        return Checkpoint(**json.loads(row[0]), sidecar=sidecar)
+
+    def save_checkpoint(self, bucket, object_key, md5, checkpoint: Checkpoint):
+        data = checkpoint._asdict()
+        sidecar = data.pop("sidecar")
+        try:
+            with self.lock:
+                self._connect().execute(
+                    "INSERT OR REPLACE INTO journal VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        bucket,
+                        object_key,
+                        md5,
+                        json.dumps(data),
+                        sidecar,
+                        time.time() + self.ttl,
+                    ),
+                )
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            log.warning("Failed to save the checkpoint.", error=str(e))
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+# vim modeline
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
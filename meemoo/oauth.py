@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  meemoo/oauth.py
+#
+#  Copyleft 2026 meemoo
+#
+
+# System imports
+import threading
+import time
+
+# Third-party imports
+from viaa.configuration import ConfigParser
+from viaa.observability import logging
+
+# Local imports
+
+# Get logger
+config = ConfigParser()
+log = logging.get_logger(__name__, config=config)
+
+
+class TokenManager(object):
+    """Keeps an OAuth token fresh.
+
+    `fetch` requests a new token and returns its token info (a dict with the
+    `access_token` and its `expires_in`). The token is refreshed
+    `refresh_margin` seconds before it expires: on access, or by a background
+    thread once `start` has been called. Concurrent refreshes are
+    single-flighted: one thread requests the token, the others wait for it.
+    If the token info has no `expires_in`, `default_expires_in` is assumed.
+    """
+
+    RETRY_INTERVAL = 5
+
+    def __init__(self, fetch, refresh_margin=60, default_expires_in=3600):
+        self.fetch = fetch
+        self.refresh_margin = refresh_margin
+        self.default_expires_in = default_expires_in
+        self.token_info = None
+        self.expires_at = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def _expires_in(self, token_info) -> float:
+        try:
+            return float(token_info["expires_in"])
+        except (KeyError, TypeError, ValueError):
+            return float(self.default_expires_in)
+
+    def _needs_refresh(self) -> bool:
+        return time.monotonic() >= self.expires_at - self.refresh_margin
+
+    def refresh(self, force=False):
+        """Request a new token, unless another thread just did so."""
+        with self.lock:
+            if not force and not self._needs_refresh():
+                return
+            token_info = self.fetch()
+            self.token_info = token_info
+            self.expires_at = time.monotonic() + self._expires_in(token_info)
+            log.debug("Refreshed the OAuth token.")
+
+    def ensure_fresh(self):
+        """Refresh the token if it is about to expire."""
+        if self._needs_refresh():
+            self.refresh()
+
+    def get_token_info(self) -> dict:
+        self.ensure_fresh()
+        return self.token_info
+
+    def invalidate(self, token_info=None):
+        """Mark the token as expired, e.g. after it got rejected.
+
+        If `token_info` is passed, only mark it expired if it still is the
+        current token, so a token refreshed in the meantime is kept.
+        """
+        with self.lock:
+            if token_info is None or token_info is self.token_info:
+                self.expires_at = 0
+
+    def start(self):
+        """Request the first token and keep it fresh in the background."""
+        self.refresh(force=True)
+        self.thread = threading.Thread(
+            target=self._run, name="token-refresher", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def _run(self):
+        while True:
+            wait = self.expires_at - self.refresh_margin - time.monotonic()
+            if self.stopped.wait(max(wait, 0)):
+                return
+            try:
+                self.refresh()
+            except Exception as e:
+                log.error("Failed to refresh the OAuth token.", error=str(e))
+                if self.stopped.wait(self.RETRY_INTERVAL):
+                    return
+
+
+def grant_fetcher(grant, username, password):
+    """Return a `fetch` for a `TokenManager` that requests a token with an
+    (ROPC) grant of the MediaHaven client.
+
+    The client keeps using the token stored on the grant. The token info is
+    the one returned by `request_token`. The grant has no public accessor
+    for it otherwise, so it falls back to the token dict stored on the grant.
+    """
+
+    def fetch():
+        token_info = grant.request_token(username, password)
+        if not isinstance(token_info, dict):
+            token_info = getattr(grant, "_token_dict", None)
+        if not isinstance(token_info, dict) or "expires_in" not in token_info:
+            log.warning(
+                "No expiry found for the MediaHaven token, assuming the default."
+            )
+        return token_info
+
+    return fetch
+
+
+# vim modeline
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
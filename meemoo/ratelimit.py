@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  meemoo/ratelimit.py
+#
+#  Copyleft 2026 meemoo
+#
+
+# System imports
+import email.utils
+import functools
+import threading
+import time
+from datetime import datetime, timezone
+
+# Third-party imports
+
+# Local imports
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket rate limiter.
+
+    Tokens are added at `rate` per second, up to `burst` tokens. `acquire`
+    blocks until enough tokens are available.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1.0, self.rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens=1):
+        while True:
+            with self.lock:
+                self._refill(time.monotonic())
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveRateLimiter(object):
+    """Thread-safe AIMD (additive increase, multiplicative decrease) limiter.
+
+    Calls are spaced at `rate` per second. Every healthy response increases
+    the rate so that it grows by `increase` per second, up to `max_rate`. A
+    throttled response multiplies the rate by `decrease`, down to `min_rate`,
+    and blocks all calls for `retry_after` seconds if given.
+    """
+
+    def __init__(self, rate, min_rate=1, max_rate=100, increase=1, decrease=0.5):
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.rate = min(max(float(rate), self.min_rate), self.max_rate)
+        self.increase = float(increase)
+        self.decrease = float(decrease)
+        self.next_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.decreased_at = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_at, self.blocked_until)
+            self.next_at = start + 1 / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+    def on_success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def on_throttle(self, retry_after=None):
+        with self.lock:
+            now = time.monotonic()
+            # Calls that were already in flight get throttled as well: only
+            # decrease once per interval
+            if now - self.decreased_at >= 1 / self.rate:
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self.decreased_at = now
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+
+
+THROTTLE_STATUS_CODES = (429, 503)
+
+
+def parse_retry_after(value) -> float:
+    """Parse a Retry-After header, in seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (date - datetime.now(timezone.utc)).total_seconds())
+
+
+def get_throttling(error):
+    """Return whether the error is a throttled response, and its Retry-After.
+
+    Works for `requests` errors and errors with a `status_code` attribute.
+    """
+    response = getattr(error, "response", None)
+    status_code = getattr(response, "status_code", None)
+    if status_code is None:
+        status_code = getattr(error, "status_code", None)
+    if status_code not in THROTTLE_STATUS_CODES:
+        return False, None
+    headers = getattr(response, "headers", None) or {}
+    return True, parse_retry_after(headers.get("Retry-After"))
+
+
+class ThrottledResource(object):
+    """Proxy that sends every method call of `resource` through `limiter`.
+
+    Throttled calls are retried, up to `max_attempts` calls in total, after
+    which the error is raised.
+    """
+
+    def __init__(self, resource, limiter, max_attempts=3):
+        self.resource = resource
+        self.limiter = limiter
+        self.max_attempts = max_attempts
+
+    def __getattr__(self, name):
+        attribute = getattr(self.resource, name)
+        if not callable(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        def throttled(*args, **kwargs):
+            attempt = 1
+            while True:
+                self.limiter.acquire()
+                try:
+                    result = attribute(*args, **kwargs)
+                except Exception as e:
+                    throttled, retry_after = get_throttling(e)
+                    if not throttled:
+                        raise
+                    self.limiter.on_throttle(retry_after)
+                    if attempt >= self.max_attempts:
+                        raise
+                    attempt += 1
+                else:
+                    self.limiter.on_success()
+                    return result
+
+        return throttled
+
+
+# vim modeline
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
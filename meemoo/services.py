@@ -9,20 +9,27 @@
 #
 
 # System imports
+import collections
 import functools
 import json
 import logging
+import threading
 import urllib
 from typing import List, Tuple
+from urllib.parse import urlparse
 
 # Third-party imports
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 from requests.exceptions import RequestException
+from urllib3.util.retry import Retry
 from viaa.configuration import ConfigParser
 from viaa.observability import logging
 
 # Local imports
+from meemoo.circuitbreaker import CircuitBreaker, get_circuit_breaker
+from meemoo.oauth import TokenManager
 
 # Get logger
 config = ConfigParser()
@@ -35,16 +42,79 @@ class AuthenticationException(Exception):
     pass
 
 
+SERVER_ERRORS = range(500, 600)
+
+
 class Service(object):
     """The base Service object
     TODO: use the factory pattern for service creation
+
+    Requests go through a pooled `requests.Session` per host, which is shared
+    across all service instances. The pool size, timeouts and retries are
+    configured in the `http` section of the config.
     """
 
+    _sessions = {}
+    _sessions_lock = threading.Lock()
+
     def __init__(self, ctx):
         self.name = "noname" if not self.name else self.name
         self.ctx = ctx
         self.config = ctx.config.app_cfg
         self.host = self._get_service_host()
+        self.http_config = self.config.get("http", {})
+        self.timeout = (
+            float(self.http_config.get("connect_timeout", 5)),
+            float(self.http_config.get("read_timeout", 30)),
+        )
+
+    @property
+    def session(self) -> requests.Session:
+        """The shared session for the host of this service."""
+        key = urlparse(self.host or "").netloc or self.host or self.name
+        with Service._sessions_lock:
+            session = Service._sessions.get(key)
+            if session is None:
+                session = Service._sessions[key] = self._create_session()
+        return session
+
+    def _create_session(self) -> requests.Session:
+        pool_size = int(self.http_config.get("pool_size", 10))
+        retry = Retry(
+            total=int(self.http_config.get("retries", 3)),
+            backoff_factor=float(self.http_config.get("backoff_factor", 0.5)),
+            status_forcelist=(502, 503, 504),
+            allowed_methods=None,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+        )
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    @property
+    def breaker(self) -> CircuitBreaker:
+        """The circuit breaker for the dependency of this service."""
+        return get_circuit_breaker(self.ctx, self.name)
+
+    def _request(self, method, url, **kwargs) -> requests.Response:
+        """Send a request with the shared session, through the circuit breaker.
+
+        Server errors (5xx) are raised as an HTTPError.
+        """
+
+        def send():
+            response = getattr(self.session, method)(
+                url, timeout=self.timeout, **kwargs
+            )
+            if response.status_code in SERVER_ERRORS:
+                response.raise_for_status()
+            return response
+
+        return self.breaker.call(send)
 
     def _get_service_host(self):
         host = None
@@ -83,14 +153,69 @@ class PIDService(Service):
         super().__init__(ctx)
 
     def get_pid(self) -> str:
+        return self.get_pids(1)[0]
+
+    def get_pids(self, number: int) -> List[str]:
+        """Get a batch of PIDs in one call to the service."""
         if self.ctx.dryrun:
-            pid = "a1b2c3d4e5"
+            pids = ["a1b2c3d4e5"] * number
         else:
-            resp = requests.get(self.host)
+            resp = self._request("get", self.host, params={"number": number})
             log.debug(f"Response is: {resp.json()}")
-            pid = resp.json()[0]["id"]
+            pids = [item["id"] for item in resp.json()]
+            if not pids:
+                raise IndexError("No PIDs in the response of the PID service")
+        return pids
+
+
+class PIDPool(object):
+    """Thread-safe local reservoir of PIDs.
+
+    The pool gets refilled in the background, in batches of `batch_size`, as
+    soon as the amount of PIDs left drops to `low_water_mark`. If the pool is
+    empty, e.g. because a refill failed, a PID is fetched synchronously.
+    """
+
+    def __init__(self, ctx, batch_size=None, low_water_mark=None):
+        cfg = ctx.config.app_cfg["pid-service"]
+        self.service = PIDService(ctx)
+        self.batch_size = int(batch_size or cfg.get("batch_size", 10))
+        self.low_water_mark = int(
+            cfg.get("low_water_mark", 2) if low_water_mark is None else low_water_mark
+        )
+        self.pids = collections.deque()
+        self.lock = threading.Lock()
+        self.refilling = False
+
+    def get_pid(self) -> str:
+        with self.lock:
+            pid = self.pids.popleft() if self.pids else None
+        self.refill_async()
+        if pid is None:
+            log.debug("PID pool is empty, fetching a PID synchronously.")
+            pid = self.service.get_pid()
         return pid
 
+    def refill_async(self):
+        """Start a background refill if the pool is at its low-water mark."""
+        with self.lock:
+            if self.refilling or len(self.pids) > self.low_water_mark:
+                return
+            self.refilling = True
+        threading.Thread(target=self._refill, daemon=True).start()
+
+    def _refill(self):
+        pids = []
+        try:
+            pids = self.service.get_pids(self.batch_size)
+        except Exception as e:
+            # Any error, e.g. an open circuit: the thread must reset the flag
+            log.warning("Failed to refill the PID pool.", error=str(e))
+        finally:
+            with self.lock:
+                self.pids.extend(pids)
+                self.refilling = False
+
 
 class OrgApiError(Exception):
     pass
@@ -117,16 +242,51 @@ class OrganisationsService(Service):
         }}"""
         return query
 
+    def _construct_bulk_query(self, limit: int, offset: int):
+        """Construct the Graphql query to retrieve a page of all the
+        organisations with their CP name defined in the MAM.
+        Args:
+            limit: The maximum amount of organisations in the page.
+            offset: The amount of organisations to skip.
+        Returns:
+            The graphql query.
+        """
+        query = f"""{{
+            organizations(limit:{limit}, offset:{offset}) {{
+                or_id
+                mam_label
+            }}
+        }}"""
+        return query
+
+    def get_mam_labels(self, page_size: int = 500) -> dict:
+        """Retrieve the mapping of all OR IDs to their mam label.
+
+        Organisations without a mam label are left out.
+        """
+        mam_labels = {}
+        offset = 0
+        while True:
+            query = self._construct_bulk_query(page_size, offset)
+            response = self._request("post", self.host, json={"query": query})
+            try:
+                organisations = response.json()["data"]["organizations"]
+            except (KeyError, TypeError, ValueError) as e:
+                raise OrgApiError(f"Could not fetch the mam labels: {e}")
+            for organisation in organisations:
+                if organisation.get("mam_label"):
+                    mam_labels[organisation["or_id"]] = organisation["mam_label"]
+            if len(organisations) < page_size:
+                return mam_labels
+            offset += page_size
+
     def get_mam_label(self, or_id):
         # Make sure the OR is uppercase. Organisation api needs it.
         or_id = or_id[:2].upper() + or_id[2:]
 
         query = self._construct_query(or_id)
         data_payload = {"query": query}
-        response = requests.post(
-            self.host,
-            json=data_payload,
-        )
+        response = self._request("post", self.host, json=data_payload)
         try:
             mam_label = response.json()["data"]["organizations"][0]["mam_label"]
         except (KeyError, IndexError) as e:
@@ -134,23 +294,53 @@ class OrganisationsService(Service):
         return mam_label
 
 class MediahavenService(Service):
-    """ Abstraction for the mediahaven-api. """
+    """ Abstraction for the mediahaven-api.
+
+    The tokens are cached per CP and shared across all service instances, so
+    a token is only requested once per lifetime.
+    """
+
+    _token_managers = {}
+    _token_managers_lock = threading.Lock()
 
     def __init__(self, ctx, cp_name):
         self.cp_name = cp_name
         self.name = "mediahaven-api"
-        self.token_info = None
         super().__init__(ctx)
 
+    @property
+    def tokens(self) -> TokenManager:
+        """The shared token manager for the CP of this service."""
+        with MediahavenService._token_managers_lock:
+            tokens = MediahavenService._token_managers.get(self.cp_name)
+            if tokens is None:
+                # Refreshes the token before it expires, instead of after a 401
+                tokens = MediahavenService._token_managers[
+                    self.cp_name
+                ] = TokenManager(
+                    self.__get_token,
+                    refresh_margin=int(
+                        self.config[self.name].get("token_refresh_margin", 60)
+                    ),
+                    default_expires_in=int(
+                        self.config[self.name].get("token_expires_in", 3600)
+                    ),
+                )
+        return tokens
+
+    @property
+    def token_info(self) -> dict:
+        return self.tokens.get_token_info()
+
     def __authenticate(function):
         @functools.wraps(function)
         def wrapper_authenticate(self, *args, **kwargs):
-            if not self.token_info:
-                self.token_info = self.__get_token()
+            token_info = self.token_info
             try:
                 return function(self, *args, **kwargs)
             except AuthenticationException:
-                self.token_info = self.__get_token()
+                # Revoked before its expiry: get a new one and try again
+                self.tokens.invalidate(token_info)
             return function(self, *args, **kwargs)
 
         return wrapper_authenticate
@@ -163,7 +353,8 @@ class MediahavenService(Service):
         payload = {"grant_type": "password"}
 
         try:
-            r = requests.post(
+            r = self._request(
+                "post",
                 url,
                 auth=HTTPBasicAuth(user.encode("utf-8"), password.encode("utf-8")),
                 data=payload,
@@ -205,7 +396,7 @@ class MediahavenService(Service):
         params = urllib.parse.urlencode(params_dict, quote_via=urllib.parse.quote)
 
         # Send the GET request
-        response = requests.get(url, headers=headers, params=params,)
+        response = self._request("get", url, headers=headers, params=params)
 
         if response.status_code == 401:
             # AuthenticationException triggers a retry with a new token
@@ -226,7 +417,7 @@ class MediahavenService(Service):
         data: dict = {"metadata": sidecar, "reason": "metadataUpdated"}
 
         # Send the POST request, as multipart/form-data
-        response = requests.post(url, headers=headers, files=data)
+        response = self._request("post", url, headers=headers, files=data)
 
         if response.status_code == 401:
             # AuthenticationException triggers a retry with a new token
@@ -247,7 +438,7 @@ class MediahavenService(Service):
         data = {"reason": reason}
 
         # Send the DELETE request
-        response = requests.delete(url, headers=headers, files=data)
+        response = self._request("delete", url, headers=headers, files=data)
 
         if response.status_code == 401:
             # AuthenticationException triggers a retry with a new token
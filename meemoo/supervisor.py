@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  meemoo/supervisor.py
+#
+#  Copyleft 2026 meemoo
+#
+
+# System imports
+import multiprocessing
+import signal
+import time
+from multiprocessing.connection import wait
+
+# Third-party imports
+from viaa.configuration import ConfigParser
+from viaa.observability import logging
+
+# Local imports
+
+# Get logger
+config = ConfigParser()
+log = logging.get_logger(__name__, config=config)
+
+
+def _run_worker(target):
+    # Forked workers inherit the signal handlers of the supervisor. SIGINT
+    # (e.g. ^C) hits the whole process group: leave it to the supervisor,
+    # which forwards a SIGTERM.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    target()
+
+
+class Supervisor(object):
+    """Pre-forks `processes` worker processes that each run `target`.
+
+    A worker that exits is restarted after a backoff, which doubles with
+    every consecutive crash up to `max_backoff` seconds. A worker that ran
+    for `stable_after` seconds resets its backoff. On SIGTERM or SIGINT, a
+    SIGTERM is forwarded to all workers, which get `drain_timeout` seconds to
+    finish before they are killed.
+
+    The workers are forked before any connection is opened, so `target`
+    should set up its own connections and clients.
+    """
+
+    POLL_INTERVAL = 1
+
+    def __init__(
+        self,
+        target,
+        processes,
+        backoff=1,
+        max_backoff=60,
+        stable_after=60,
+        drain_timeout=30,
+    ):
+        self.target = target
+        self.processes = processes
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stable_after = stable_after
+        self.drain_timeout = drain_timeout
+        self.mp = multiprocessing.get_context("fork")
+        # Per slot: the process, when it started, its next backoff and when
+        # to restart it
+        self.workers = {}
+        self.started_at = {}
+        self.backoffs = {}
+        self.restart_at = {}
+        self.restarts = 0
+        self.stopped = False
+
+    def stop(self, *args):
+        self.stopped = True
+
+    def _spawn(self, slot):
+        process = self.mp.Process(
+            target=_run_worker,
+            args=(self.target,),
+            name=f"s3-events-worker-{slot}",
+        )
+        process.start()
+        self.workers[slot] = process
+        self.started_at[slot] = time.monotonic()
+        log.info(f"Started worker {slot}.", pid=process.pid)
+
+    def _on_exit(self, slot):
+        process = self.workers.pop(slot)
+        now = time.monotonic()
+        backoff = self.backoffs.get(slot, self.backoff)
+        if now - self.started_at[slot] >= self.stable_after:
+            backoff = self.backoff
+        log.error(
+            f"Worker {slot} exited, restarting in {backoff}s.",
+            pid=process.pid,
+            exitcode=process.exitcode,
+        )
+        self.restart_at[slot] = now + backoff
+        self.backoffs[slot] = min(backoff * 2, self.max_backoff)
+
+    def run(self):
+        handlers = {
+            signum: signal.signal(signum, self.stop)
+            for signum in (signal.SIGTERM, signal.SIGINT)
+        }
+        try:
+            self._supervise()
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+
+    def _supervise(self):
+        for slot in range(self.processes):
+            self._spawn(slot)
+
+        while not self.stopped:
+            sentinels = [process.sentinel for process in self.workers.values()]
+            timeout = self.POLL_INTERVAL
+            if self.restart_at:
+                next_restart = min(self.restart_at.values()) - time.monotonic()
+                timeout = max(0.0, min(timeout, next_restart))
+            wait(sentinels, timeout=timeout)
+            for slot, process in list(self.workers.items()):
+                if not process.is_alive():
+                    self._on_exit(slot)
+            now = time.monotonic()
+            for slot, restart_at in list(self.restart_at.items()):
+                if restart_at <= now and not self.stopped:
+                    del self.restart_at[slot]
+                    self.restarts += 1
+                    self._spawn(slot)
+
+        self._drain()
+
+    def _drain(self):
+        log.info("Stopping the workers.")
+        for process in self.workers.values():
+            process.terminate()
+        deadline = time.monotonic() + self.drain_timeout
+        for process in self.workers.values():
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                log.warning("Killing worker after drain timeout.", pid=process.pid)
+                process.kill()
+                process.join()
+
+
+# vim modeline
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
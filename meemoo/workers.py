@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  meemoo/workers.py
+#
+#  Copyleft 2026 meemoo
+#
+
+# System imports
+import collections
+import functools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Third-party imports
+from viaa.configuration import ConfigParser
+from viaa.observability import logging
+
+# Local imports
+
+# Get logger
+config = ConfigParser()
+log = logging.get_logger(__name__, config=config)
+
+
+class ThreadSafeChannel(object):
+    """Proxy for a pika channel that can be handed to a worker thread.
+
+    A `BlockingConnection` and its channels are not thread-safe: acks and nacks
+    issued from a worker thread are marshalled back to the connection thread
+    via `add_callback_threadsafe`.
+    """
+
+    def __init__(self, connection, channel):
+        self.connection = connection
+        self.channel = channel
+
+    def basic_ack(self, delivery_tag):
+        self.connection.add_callback_threadsafe(
+            functools.partial(self.channel.basic_ack, delivery_tag=delivery_tag)
+        )
+
+    def basic_nack(self, delivery_tag, requeue=False):
+        self.connection.add_callback_threadsafe(
+            functools.partial(
+                self.channel.basic_nack, delivery_tag=delivery_tag, requeue=requeue
+            )
+        )
+
+
+class KeyedExecutor(object):
+    """Thread pool that runs the tasks with the same key in order.
+
+    The tasks of a key are queued on a lane, which runs them one at a time,
+    in the order they were submitted. Lanes of different keys run in
+    parallel, on at most `workers` threads. A lane only exists while it has
+    tasks, so the amount of lanes and their depth are bounded by the amount
+    of tasks submitted but not yet done. Tasks with key None are not
+    ordered.
+    """
+
+    def __init__(self, workers, thread_name_prefix=""):
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix=thread_name_prefix
+        )
+        self.lanes = {}
+        self.lock = threading.Lock()
+
+    def submit(self, key, fn, *args) -> Future:
+        if key is None:
+            key = object()
+        task = (fn, args, Future())
+        with self.lock:
+            lane = self.lanes.get(key)
+            if lane is not None:
+                lane.append(task)
+                return task[2]
+            self.lanes[key] = collections.deque()
+        self.executor.submit(self._run_lane, key, task)
+        return task[2]
+
+    def _run_lane(self, key, task):
+        while task is not None:
+            fn, args, future = task
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = fn(*args)
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+            with self.lock:
+                lane = self.lanes[key]
+                if lane:
+                    task = lane.popleft()
+                else:
+                    del self.lanes[key]
+                    task = None
+
+    def busy(self) -> bool:
+        """Whether tasks are submitted but not yet done."""
+        with self.lock:
+            return bool(self.lanes)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+class WorkerPool(object):
+    """Bounded thread pool that runs the message handler off the connection
+    thread.
+
+    The handler gets called with the same arguments as a pika
+    `on_message_callback`, but with the channel wrapped in a
+    `ThreadSafeChannel`. The amount of messages in flight is bounded by the
+    prefetch count of the consuming channel.
+
+    If `parse` is given, the body is parsed once, on dispatch, and the
+    handler gets the result as an extra argument. Messages for which `key`
+    of the (parsed) body returns the same key are handled in the order they
+    were delivered, see `KeyedExecutor`.
+    """
+
+    def __init__(self, connection, workers, handler, parse=None, key=None):
+        self.connection = connection
+        self.workers = workers
+        self.handler = handler
+        self.parse = parse
+        self.key = key
+        self.executor = KeyedExecutor(workers, thread_name_prefix="s3-events-worker")
+
+    def dispatch(self, ch, method, properties, body):
+        """Submit a delivered message to the pool. Meant to be used as the
+        `on_message_callback` of the consumer."""
+        channel = ThreadSafeChannel(self.connection, ch)
+        args = (channel, method, properties, body)
+        parsed = body
+        if self.parse:
+            parsed = self.parse(body)
+            args += (parsed,)
+        key = self.key(parsed) if self.key else None
+        future = self.executor.submit(key, self.handler, *args)
+        future.add_done_callback(
+            functools.partial(self._on_done, channel, method.delivery_tag)
+        )
+
+    def _on_done(self, channel, delivery_tag, future):
+        error = future.exception()
+        if error is None:
+            return
+        # An unhandled error would otherwise leave the message unacked forever
+        log.error(
+            "Unexpected error while handling the s3 event.",
+            error=str(error),
+            delivery_tag=delivery_tag,
+        )
+        channel.basic_nack(delivery_tag=delivery_tag, requeue=False)
+
+    def drain(self, poll_interval=0.1):
+        """Let the messages in flight finish, then shut the pool down.
+
+        Must be called from the connection thread. The connection keeps
+        being served while the pool drains: the handlers marshal their acks
+        and publishes to it, and would otherwise wait on it forever.
+        """
+        while self.executor.busy() and self.connection.is_open:
+            self.connection.process_data_events(time_limit=poll_interval)
+        self.shutdown()
+        if self.connection.is_open:
+            # Flush the acks of the last messages
+            self.connection.process_data_events(time_limit=0)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+# vim modeline
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
@@ -42,10 +42,16 @@ def mock_events(monkeypatch):
         print(f"Publish message: {message}")
         pass
 
-    from meemoo.events import Events
+    def mock_publisher_init(self, queue_info, ctx, connection=None):
+        print("Initiating publisher.")
+        pass
+
+    from meemoo.events import Events, Publisher
 
     monkeypatch.setattr(Events, "__init__", mock_init)
     monkeypatch.setattr(Events, "publish", mock_publish)
+    monkeypatch.setattr(Publisher, "__init__", mock_publisher_init)
+    monkeypatch.setattr(Publisher, "publish", mock_publish)
 
 
 @pytest.fixture
@@ -0,0 +1,50 @@
+import threading
+from unittest.mock import MagicMock
+
+import pytest
+
+from meemoo.batching import MicroBatcher
+
+
+def _submit_concurrently(batcher, items):
+    results = {}
+
+    def submit(item):
+        try:
+            results[item] = batcher.submit(item)
+        except Exception as e:
+            results[item] = e
+
+    threads = [threading.Thread(target=submit, args=(item,)) for item in items]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_micro_batcher_flushes_when_full():
+    flush = MagicMock(side_effect=lambda items: [item * 2 for item in items])
+    batcher = MicroBatcher(flush, max_size=3, max_wait=10)
+
+    results = _submit_concurrently(batcher, [1, 2, 3])
+
+    assert results == {1: 2, 2: 4, 3: 6}
+    assert flush.call_count == 1
+
+
+def test_micro_batcher_flushes_after_wait():
+    flush = MagicMock(side_effect=lambda items: [item * 2 for item in items])
+    batcher = MicroBatcher(flush, max_size=10, max_wait=0.01)
+
+    assert batcher.submit(1) == 2
+    assert flush.call_count == 1
+
+
+def test_micro_batcher_raises_error_for_every_item():
+    flush = MagicMock(side_effect=ConnectionError())
+    batcher = MicroBatcher(flush, max_size=2, max_wait=10)
+
+    results = _submit_concurrently(batcher, [1, 2])
+
+    assert all(isinstance(result, ConnectionError) for result in results.values())
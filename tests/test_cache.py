@@ -0,0 +1,109 @@
+import threading
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+from meemoo.cache import TTLCache
+
+
+class NotFound(Exception):
+    pass
+
+
+def test_ttl_cache_hit_and_miss():
+    cache = TTLCache(ttl=60)
+    loader = MagicMock(return_value="UNITTEST")
+
+    assert cache.get("OR-a1b2c3d", loader) == "UNITTEST"
+    assert cache.get("OR-a1b2c3d", loader) == "UNITTEST"
+
+    assert loader.call_count == 1
+    assert cache.stats() == {"hits": 1, "misses": 1, "size": 1}
+
+
+def test_ttl_cache_expires():
+    cache = TTLCache(ttl=0.01)
+    loader = MagicMock(return_value="UNITTEST")
+
+    cache.get("OR-a1b2c3d", loader)
+    time.sleep(0.02)
+    cache.get("OR-a1b2c3d", loader)
+
+    assert loader.call_count == 2
+
+
+def test_ttl_cache_lru_bound():
+    cache = TTLCache(maxsize=2)
+
+    cache["a"] = 1
+    cache["b"] = 2
+    cache.get("a", MagicMock())  # Mark "a" as recently used
+    cache["c"] = 3
+
+    assert "a" in cache
+    assert "b" not in cache
+    assert len(cache) == 2
+
+
+def test_ttl_cache_negative_caching():
+    cache = TTLCache(negative_ttl=60, negative_exceptions=(NotFound,))
+    loader = MagicMock(side_effect=NotFound("unknown"))
+
+    for _ in range(2):
+        with pytest.raises(NotFound):
+            cache.get("OR-unknown", loader)
+
+    assert loader.call_count == 1
+
+
+def test_ttl_cache_does_not_cache_other_errors():
+    cache = TTLCache(negative_exceptions=(NotFound,))
+    loader = MagicMock(side_effect=[ConnectionError(), "UNITTEST"])
+
+    with pytest.raises(ConnectionError):
+        cache.get("OR-a1b2c3d", loader)
+
+    assert cache.get("OR-a1b2c3d", loader) == "UNITTEST"
+
+
+def test_ttl_cache_coalesces_concurrent_loads():
+    cache = TTLCache()
+    release = threading.Event()
+
+    def loader(key):
+        release.wait(1)
+        return "UNITTEST"
+
+    loader_mock = MagicMock(side_effect=loader)
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(cache.get("OR-a1b2c3d", loader_mock))
+        )
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert results == ["UNITTEST"] * 5
+    assert loader_mock.call_count == 1
+
+
+def test_ttl_cache_refreshes_ahead():
+    cache = TTLCache(ttl=60, refresh_ahead=0)
+    loader = MagicMock(side_effect=["old", "new"])
+
+    cache.get("OR-a1b2c3d", loader)
+    # Returns the current value and refreshes in the background
+    assert cache.get("OR-a1b2c3d", loader) == "old"
+    for _ in range(100):
+        if loader.call_count == 2 and not cache.loading:
+            break
+        time.sleep(0.01)
+
+    assert cache["OR-a1b2c3d"] == "new"
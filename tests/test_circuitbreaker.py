@@ -0,0 +1,110 @@
+import time
+from unittest.mock import MagicMock
+
+import pytest
+from requests.exceptions import ConnectionError, HTTPError
+
+from meemoo.circuitbreaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+    get_circuit_breaker,
+    is_unavailable,
+)
+
+
+@pytest.fixture
+def context():
+    from viaa.configuration import ConfigParser
+    from meemoo.context import Context
+
+    config = ConfigParser()
+    return Context(config)
+
+
+def _http_error(status_code):
+    return HTTPError(response=MagicMock(status_code=status_code))
+
+
+def test_is_unavailable():
+    assert is_unavailable(ConnectionError())
+    assert is_unavailable(TimeoutError())
+    assert is_unavailable(_http_error(503))
+    assert not is_unavailable(_http_error(404))
+    assert not is_unavailable(KeyError())
+
+
+def test_circuit_breaker_opens_after_threshold():
+    breaker = CircuitBreaker("unittest", failure_threshold=2, reset_timeout=60)
+    function = MagicMock(side_effect=ConnectionError())
+
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            breaker.call(function)
+
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError) as exc_info:
+        breaker.call(function)
+    assert function.call_count == 2
+    assert 0 < exc_info.value.retry_in <= 60
+
+
+def test_circuit_breaker_ignores_other_errors():
+    breaker = CircuitBreaker("unittest", failure_threshold=1)
+
+    with pytest.raises(HTTPError):
+        breaker.call(MagicMock(side_effect=_http_error(404)))
+
+    assert breaker.state == CLOSED
+
+
+def test_circuit_breaker_half_open_trial():
+    breaker = CircuitBreaker("unittest", failure_threshold=1, reset_timeout=0.01)
+    with pytest.raises(ConnectionError):
+        breaker.call(MagicMock(side_effect=ConnectionError()))
+    time.sleep(0.02)
+
+    # A single trial call goes through
+    breaker.before_call()
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.call(MagicMock(return_value="result")) == "result"
+
+
+def test_circuit_breaker_failed_trial_reopens():
+    breaker = CircuitBreaker("unittest", failure_threshold=3, reset_timeout=0.01)
+    breaker.state = OPEN
+    time.sleep(0.02)
+
+    with pytest.raises(ConnectionError):
+        breaker.call(MagicMock(side_effect=ConnectionError()))
+
+    assert breaker.state == OPEN
+
+
+def test_circuit_breaker_wrap():
+    breaker = CircuitBreaker("unittest", failure_threshold=1)
+    records = MagicMock()
+    records.search.side_effect = ConnectionError()
+    guarded = breaker.wrap(records)
+
+    with pytest.raises(ConnectionError):
+        guarded.search(q="query")
+    with pytest.raises(CircuitOpenError):
+        guarded.search(q="query")
+
+    assert records.search.call_count == 1
+
+
+def test_get_circuit_breaker(context):
+    breaker = get_circuit_breaker(context, "pid-service")
+
+    assert get_circuit_breaker(context, "pid-service") is breaker
+    assert get_circuit_breaker(context, "ftp") is not breaker
+    assert breaker.failure_threshold == 5
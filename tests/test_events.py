@@ -0,0 +1,231 @@
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import pika
+import pytest
+
+from meemoo.events import (
+    Consumer,
+    DelayedRetry,
+    Events,
+    PendingRetries,
+    Publisher,
+)
+
+QUEUE_INFO = {"queue": "ftp_queue", "exchange": "ftp_exchange"}
+
+
+@pytest.fixture
+def context():
+    from viaa.configuration import ConfigParser
+    from meemoo.context import Context
+
+    config = ConfigParser()
+    return Context(config)
+
+
+def _connection_mock():
+    connection = MagicMock()
+    connection.is_closed = False
+    connection.channel.return_value.is_closed = False
+    return connection
+
+
+@patch.object(Events, "_init_connection")
+def test_publisher_shares_connection(init_connection_mock, context):
+    connection = _connection_mock()
+    publisher = Publisher(QUEUE_INFO, context, connection=connection)
+
+    publisher.publish("message", "a1b2c3")
+    publisher.publish("message", "a1b2c3")
+
+    assert not init_connection_mock.call_count
+    # Topology is declared only once
+    assert connection.channel().queue_declare.call_count == 1
+    assert connection.channel().basic_publish.call_count == 2
+
+
+def test_publisher_marshals_from_other_thread(context):
+    connection = _connection_mock()
+    connection.add_callback_threadsafe.side_effect = lambda cb: cb()
+    publisher = Publisher(QUEUE_INFO, context, connection=connection)
+
+    thread = threading.Thread(target=publisher.publish, args=("message", "a1b2c3"))
+    thread.start()
+    thread.join()
+
+    assert connection.add_callback_threadsafe.call_count == 1
+    assert connection.channel().basic_publish.call_count == 1
+
+
+def test_publisher_times_out_when_connection_thread_is_gone(context):
+    # The connection got closed after the publish was queued: it never runs
+    connection = _connection_mock()
+    publisher = Publisher(
+        dict(QUEUE_INFO, publish_timeout=0.05), context, connection=connection
+    )
+    errors = []
+
+    def publish():
+        try:
+            publisher.publish("message", "a1b2c3")
+        except pika.exceptions.AMQPError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=publish)
+    thread.start()
+    thread.join(timeout=2)
+
+    assert not thread.is_alive()
+    assert len(errors) == 1
+    # Running the queued callback after the timeout doesn't publish anymore
+    connection.add_callback_threadsafe.call_args.args[0]()
+    assert not connection.channel().basic_publish.call_count
+
+
+@patch.object(Events, "_init_connection")
+def test_publisher_reconnects(init_connection_mock, context):
+    connection = _connection_mock()
+    publisher = Publisher(QUEUE_INFO, context, connection=connection)
+    connection.is_closed = True
+
+    publisher.publish("message", "a1b2c3")
+
+    assert init_connection_mock.call_count == 1
+    assert not publisher.shared
+    assert init_connection_mock().channel().basic_publish.call_count == 1
+
+
+def test_delayed_retry_declares_delay_queues(context):
+    connection = _connection_mock()
+    publisher = Publisher(QUEUE_INFO, context, connection=connection)
+
+    DelayedRetry(publisher, "s3_queue", [10, 60])
+
+    declared = [
+        call.kwargs for call in connection.channel().queue_declare.call_args_list
+    ]
+    assert {
+        "queue": "s3_queue.retry.60s",
+        "durable": True,
+        "arguments": {
+            "x-message-ttl": 60000,
+            "x-dead-letter-exchange": "",
+            "x-dead-letter-routing-key": "s3_queue",
+        },
+    } in declared
+
+
+@pytest.mark.parametrize(
+    "headers, expected_queue, expected_count",
+    [
+        (None, "s3_queue.retry.10s", 1),
+        ({"x-retry-count": 1}, "s3_queue.retry.60s", 2),
+        ({"x-retry-count": 5}, "s3_queue.retry.60s", 6),
+    ],
+)
+def test_delayed_retry_schedule(headers, expected_queue, expected_count, context):
+    connection = _connection_mock()
+    publisher = Publisher(QUEUE_INFO, context, connection=connection)
+    retry = DelayedRetry(publisher, "s3_queue", [10, 60])
+    channel = MagicMock()
+    properties = MagicMock(headers=headers, correlation_id="a1b2c3")
+
+    assert retry.schedule(channel, 1, properties, b"body")
+
+    publish_kwargs = connection.channel().basic_publish.call_args.kwargs
+    assert publish_kwargs["routing_key"] == expected_queue
+    assert publish_kwargs["body"] == b"body"
+    assert publish_kwargs["properties"].headers["x-retry-count"] == expected_count
+    channel.basic_ack.assert_called_once_with(delivery_tag=1)
+
+
+def test_delayed_retry_defer(context):
+    connection = _connection_mock()
+    publisher = Publisher(QUEUE_INFO, context, connection=connection)
+    retry = DelayedRetry(publisher, "s3_queue", [10, 60])
+    channel = MagicMock()
+    properties = MagicMock(headers={"x-retry-count": 1}, correlation_id="a1b2c3")
+
+    retry.defer(channel, 1, properties, b"body", 60)
+
+    publish_kwargs = connection.channel().basic_publish.call_args.kwargs
+    assert publish_kwargs["routing_key"] == "s3_queue.retry.60s"
+    # Waiting behind another message doesn't count as a retry
+    assert publish_kwargs["properties"].headers["x-retry-count"] == 1
+    channel.basic_ack.assert_called_once_with(delivery_tag=1)
+
+
+def test_pending_retries():
+    pending = PendingRetries(grace=60)
+    pending.add("key", "create", 10)
+
+    assert pending.get("key") == ("create", 10)
+    assert pending.get("other") is None
+    # Only the message that awaits the retry clears it
+    pending.discard("key", "remove")
+    assert pending.get("key") == ("create", 10)
+    pending.discard("key", "create")
+    assert pending.get("key") is None
+
+
+def test_pending_retries_expire():
+    pending = PendingRetries(grace=0)
+    pending.add("key", "create", 0, wait=0.01)
+
+    assert pending.get("key") == ("create", 0)
+    time.sleep(0.02)
+    assert pending.get("key") is None
+
+
+def test_delayed_retry_max_retries(context):
+    connection = _connection_mock()
+    publisher = Publisher(QUEUE_INFO, context, connection=connection)
+    retry = DelayedRetry(publisher, "s3_queue", [10], max_retries=3)
+    channel = MagicMock()
+    properties = MagicMock(headers={"x-retry-count": 3})
+
+    assert not retry.schedule(channel, 1, properties, b"body")
+
+    assert not connection.channel().basic_publish.call_count
+    channel.basic_nack.assert_called_once_with(delivery_tag=1, requeue=False)
+
+
+def test_consumer_pauses_and_resumes():
+    connection = _connection_mock()
+    channel = MagicMock()
+    consumer = Consumer(connection, channel, "queue", MagicMock())
+    consumer.start()
+    rounds = []
+
+    def process_data_events(time_limit):
+        rounds.append(consumer.consumer_tag)
+        if len(rounds) == 1:
+            # Called from a consumer callback, on the connection thread
+            consumer.pause(0.01)
+            consumer.pause(0.01)
+        elif len(rounds) == 2:
+            time.sleep(0.02)
+        else:
+            consumer.stop()
+
+    connection.process_data_events.side_effect = process_data_events
+    consumer.run()
+
+    # Paused during the second round, resumed and cancelled when stopped
+    assert rounds[1] is None and rounds[2] is not None
+    assert channel.basic_consume.call_count == 2
+    assert channel.basic_cancel.call_count == 2
+
+
+def test_consumer_pause_from_other_thread():
+    connection = _connection_mock()
+    consumer = Consumer(connection, MagicMock(), "queue", MagicMock())
+    consumer.start()
+
+    thread = threading.Thread(target=consumer.pause, args=(5,))
+    thread.start()
+    thread.join()
+
+    connection.add_callback_threadsafe.assert_called_once()
@@ -15,6 +15,8 @@
 #######################################################################
 
 import json
+import os
+from unittest.mock import patch
 
 # External imports
 import pytest
@@ -26,7 +28,11 @@ from meemoo.helpers import (
     normalize_or_id,
     is_event_valid,
     InvalidEventException,
-    get_destination_for_cp
+    get_destination_for_cp,
+    DestinationConfig,
+    FTPPool,
+    S3Event,
+    S3_FIELDS,
 )
 from tests.resources import (
     S3_MOCK_ESSENCE_EVENT,
@@ -72,6 +78,28 @@ def test_get_from_event():
     assert or_id == "OR-rf5kf25"
 
 
+def test_s3_event_from_dict():
+    # Arrange
+    event_dict = json.loads(S3_MOCK_ESSENCE_EVENT)
+    # Act
+    event = S3Event.from_dict(event_dict)
+    # Assert
+    for field in S3_FIELDS:
+        assert getattr(event, field) == get_from_event(event_dict, field)
+    with pytest.raises(AttributeError):
+        event.bucket = "other"
+
+
+def test_s3_event_from_dict_invalid():
+    # Arrange
+    event_dict = json.loads(S3_MOCK_ESSENCE_EVENT)
+    event_dict["Records"][0]["s3"]["object"]["key"] = ""
+    # Act and Assert
+    with pytest.raises(InvalidEventException) as excinfo:
+        S3Event.from_dict(event_dict)
+    assert "Not all fields are present" in str(excinfo.value)
+
+
 def test_normalize_or_id_valid():
     # Arrange
     or_id = "or-a1b2c3d"
@@ -189,4 +217,76 @@ def test_file_destination(environment, cp, file_type, expected_destination):
     assert destination == expected_destination
 
 
+def test_destination_config_reloads_on_change(tmp_path):
+    # Arrange
+    path = tmp_path / "destination_config.yml"
+    path.write_text("production:\n  vrt:\n    essence: TAPE-SHARE-EVENTS\n")
+    destinations = DestinationConfig(str(path))
+    assert destinations.get("production", "vrt", "essence") == "TAPE-SHARE-EVENTS"
+    # Act
+    path.write_text("production:\n  vrt:\n    essence: DISK-SHARE-EVENTS\n")
+    os.utime(path, ns=(0, destinations.mtime + 1_000_000_000))
+    # Assert
+    assert destinations.get("production", "vrt", "essence") == "DISK-SHARE-EVENTS"
+
+
+def test_destination_config_keeps_previous_on_invalid_change(tmp_path):
+    # Arrange
+    path = tmp_path / "destination_config.yml"
+    path.write_text("production:\n  vrt:\n    essence: TAPE-SHARE-EVENTS\n")
+    destinations = DestinationConfig(str(path))
+    destinations.load()
+    # Act
+    path.write_text("production:\n  vrt: TAPE-SHARE-EVENTS\n")
+    os.utime(path, ns=(0, destinations.mtime + 1_000_000_000))
+    # Assert
+    assert destinations.get("production", "vrt", "essence") == "TAPE-SHARE-EVENTS"
+
+
+def test_destination_config_invalid(tmp_path):
+    # Arrange
+    path = tmp_path / "destination_config.yml"
+    path.write_text("production:\n  vrt:\n    essence: [TAPE-SHARE-EVENTS]\n")
+    # Act and Assert
+    with pytest.raises(ValueError):
+        DestinationConfig(str(path)).load()
+
+
+@pytest.fixture
+def context():
+    from viaa.configuration import ConfigParser
+    from meemoo.context import Context
+
+    config = ConfigParser()
+    return Context(config)
+
+
+@patch("meemoo.helpers.BuiltinFTP")
+def test_ftp_pool_reuses_session(builtin_ftp_mock, context):
+    # Arrange
+    pool = FTPPool(context, size=1)
+    # Act
+    pool.put(b"<xml/>", "/VRT/DISK-SHARE-EVENTS", "pid1.xml")
+    pool.put(b"<xml/>", "/VRT/DISK-SHARE-EVENTS", "pid2.xml")
+    # Assert
+    conn = builtin_ftp_mock()
+    assert builtin_ftp_mock.call_count == 2  # Including the call above
+    assert conn.cwd.call_count == 1
+    assert conn.storbinary.call_count == 2
+    conn.voidcmd.assert_called_once_with("NOOP")
+
+
+@patch("meemoo.helpers.BuiltinFTP")
+def test_ftp_pool_replaces_stale_session(builtin_ftp_mock, context):
+    # Arrange
+    pool = FTPPool(context, size=1)
+    pool.put(b"<xml/>", "/VRT/DISK-SHARE-EVENTS", "pid1.xml")
+    builtin_ftp_mock().voidcmd.side_effect = EOFError()
+    # Act
+    pool.put(b"<xml/>", "/VRT/DISK-SHARE-EVENTS", "pid2.xml")
+    # Assert
+    assert builtin_ftp_mock.call_count == 3  # Including the call above
+    assert builtin_ftp_mock().quit.call_count == 1
+
+
 # vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4 smartindent
@@ -0,0 +1,89 @@
+import json
+import time
+
+import pytest
+
+from meemoo.helpers import S3Event
+from meemoo.idempotency import (
+    DONE,
+    Checkpoint,
+    EventRecord,
+    IdempotencyStore,
+    event_fingerprint,
+)
+
+from .resources import S3_MOCK_ESSENCE_EVENT
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = IdempotencyStore(str(tmp_path / "idempotency.sqlite"))
+    yield store
+    store.close()
+
+
+def test_event_fingerprint():
+    event = S3Event.from_dict(json.loads(S3_MOCK_ESSENCE_EVENT))
+
+    assert event_fingerprint(event) == event_fingerprint(event._replace())
+    assert event_fingerprint(event) != event_fingerprint(event._replace(md5="other"))
+    assert event_fingerprint(event) != event_fingerprint(
+        event._replace(event_name="ObjectRemoved:Delete")
+    )
+
+
+def test_store_records_outcomes(store):
+    assert store.get("fingerprint") is None
+
+    store.record("fingerprint", "bucket", "key", DONE, pid="a1b2c3")
+    assert store.get("fingerprint") == EventRecord(DONE, {"pid": "a1b2c3"})
+
+
+def test_store_expires_records(tmp_path):
+    store = IdempotencyStore(str(tmp_path / "idempotency.sqlite"), ttl=0.01)
+    store.record("fingerprint", "bucket", "key", DONE)
+    time.sleep(0.02)
+
+    assert store.get("fingerprint") is None
+
+
+def test_store_keeps_latest_event_per_object(store):
+    store.record("created", "bucket", "key", DONE)
+    store.record("other", "bucket", "other_key", DONE)
+    store.record("removed", "bucket", "key", DONE)
+
+    assert store.get("created") is None
+    assert store.get("other") is not None
+    assert store.get("removed") is not None
+
+
+def test_store_persists_across_connections(tmp_path):
+    path = str(tmp_path / "idempotency.sqlite")
+    IdempotencyStore(path).record("fingerprint", "bucket", "key", DONE)
+
+    assert IdempotencyStore(path).get("fingerprint").outcome == DONE
+
+
+def test_store_errors_are_a_miss(tmp_path):
+    store = IdempotencyStore(str(tmp_path))  # A directory, can't be opened
+
+    store.record("fingerprint", "bucket", "key", DONE)
+    assert store.get("fingerprint") is None
+
+
+def test_store_journal_checkpoints(store):
+    assert store.get_checkpoint("bucket", "key", "md5") == Checkpoint()
+
+    checkpoint = Checkpoint(pid="a1b2c3", sidecar=b"<xml/>", transferred=True)
+    store.save_checkpoint("bucket", "key", "md5", checkpoint)
+
+    assert store.get_checkpoint("bucket", "key", "md5") == checkpoint
+    assert store.get_checkpoint("bucket", "key", "other_md5") == Checkpoint()
+
+
+def test_store_done_clears_journal(store):
+    store.save_checkpoint("bucket", "key", "md5", Checkpoint(pid="a1b2c3"))
+
+    store.record("fingerprint", "bucket", "key", DONE)
+
+    assert store.get_checkpoint("bucket", "key", "md5") == Checkpoint()
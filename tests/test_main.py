@@ -2,16 +2,34 @@ import json
 from unittest.mock import MagicMock, patch
 
 import pytest
+from requests.exceptions import RequestException
+from pika.exceptions import AMQPError
 from main import (
     callback,
+    check_items_ingested,
     construct_collateral_sidecar,
     construct_essence_sidecar,
     construct_fragment_update_sidecar,
     cp_names,
+    execute_removal_plan,
     get_cp_name,
+    delete_media_objects,
+    ensure_mediahaven_token,
+    config as main_config,
+    event_key,
+    parse_args,
+    parse_event,
     handle_create_event,
+    handle_nack_exception,
+    handle_remove_event,
+    media_items,
+    plan_removal,
+    plan_removals,
+    search_collaterals,
+    RemovalPlan,
     NackException,
     query_params_item_ingested,
+    warm_up_cp_names,
 )
 from .mocks import mock_events, mock_ftp, mock_organisations_api, mock_mediahaven_api
 from .resources import (
@@ -24,8 +42,11 @@ from .resources import (
     MOCK_MEDIAHAVEN_EXTERNAL_METADATA_COLLATERAL,
     MOCK_MEDIAHAVEN_FRAGMENT_UPDATE,
 )
+from meemoo.circuitbreaker import CircuitOpenError
+from meemoo.helpers import S3Event
+from meemoo.idempotency import IdempotencyStore
 from mediahaven import MediaHaven
-from mediahaven.oauth2 import ROPCGrant
+from mediahaven.oauth2 import RequestTokenError, ROPCGrant
 from mediahaven.mocks.base_resource import MediaHavenPageObjectJSONMock
 
 
@@ -70,19 +91,19 @@ def test_callback(
 
 @patch("mediahaven.MediaHaven")
 @patch("mediahaven.oauth2.ROPCGrant")
-@patch("main.PIDService")
+@patch("main.PIDPool")
 @patch("main.construct_essence_sidecar")
-@patch("main.FTP")
+@patch("main.FTPPool")
 @patch("main.OrganisationsService")
-@patch("main.Events")
+@patch("main.Publisher")
 @patch("main.construct_collateral_sidecar")
 def test_handle_create_event_essence(
     construct_collateral_sidecar_mock,
-    events_mock,
+    publisher_mock,
     org_service_mock,
     ftp_mock,
     construct_essence_sidecar_mock,
-    pid_service_mock,
+    pid_pool_mock,
     grant_mock,
     mediahaven_mock,
     context,
@@ -93,34 +114,35 @@ def test_handle_create_event_essence(
     mediahaven_mock.records.search.return_value = MediaHavenPageObjectJSONMock(
         [], nr_of_results=0
     )
-    pid_service_mock().get_pid.return_value = "12345678"
-    handle_create_event(json.loads(S3_MOCK_ESSENCE_EVENT), ex, context, mediahaven_mock)
+    pid_pool_mock().get_pid.return_value = "12345678"
+    event = S3Event.from_dict(json.loads(S3_MOCK_ESSENCE_EVENT))
+    handle_create_event(event, ex, context, mediahaven_mock)
 
     assert construct_essence_sidecar_mock.call_count == 1
     assert ftp_mock().put.call_count == 1
-    assert events_mock().publish.call_count == 1
-    assert pid_service_mock().get_pid.call_count == 1
-    assert pid_service_mock().get_pid.return_value == "12345678"
+    assert publisher_mock().publish.call_count == 1
+    assert pid_pool_mock().get_pid.call_count == 1
+    assert pid_pool_mock().get_pid.return_value == "12345678"
     assert construct_collateral_sidecar_mock.call_count == 0
 
 
 @patch("mediahaven.MediaHaven")
 @patch("mediahaven.oauth2.ROPCGrant")
-@patch("main.PIDService")
+@patch("main.PIDPool")
 @patch("main.construct_collateral_sidecar")
-@patch("main.FTP")
+@patch("main.FTPPool")
 @patch("main.OrganisationsService")
-@patch("main.Events")
+@patch("main.Publisher")
 @patch("main.construct_fragment_update_sidecar")
 @patch("main.construct_essence_sidecar")
 def test_handle_create_event_collateral(
     construct_essence_sidecar_mock,
     construct_fragment_update_sidecar_mock,
-    events_mock,
+    publisher_mock,
     org_service_mock,
     ftp_mock,
     construct_collateral_sidecar_mock,
-    pid_service_mock,
+    pid_pool_mock,
     grant_mock,
     mediahaven_mock,
     context,
@@ -140,19 +162,215 @@ def test_handle_create_event_collateral(
         ),
     ]
 
-    pid_service_mock().get_pid.return_value = "12345678"
-    handle_create_event(
-        json.loads(S3_MOCK_COLLATERAL_EVENT), ex, context, mediahaven_mock
-    )
+    media_items.clear()
+    pid_pool_mock().get_pid.return_value = "12345678"
+    event = S3Event.from_dict(json.loads(S3_MOCK_COLLATERAL_EVENT))
+    handle_create_event(event, ex, context, mediahaven_mock)
 
     assert mediahaven_mock.records.search.call_count == 2
     assert ftp_mock().put.call_count == 1
-    assert events_mock().publish.call_count == 1
-    assert pid_service_mock().get_pid.call_count == 0
+    assert publisher_mock().publish.call_count == 1
+    assert pid_pool_mock().get_pid.call_count == 0
     assert construct_fragment_update_sidecar_mock.call_count == 1
     assert construct_essence_sidecar_mock.call_count == 0
 
 
+@patch("main.PIDPool")
+@patch("main.FTPPool")
+@patch("main.OrganisationsService")
+@patch("main.Publisher")
+def test_handle_create_event_duplicate(
+    publisher_mock, org_service_mock, ftp_mock, pid_pool_mock, context, tmp_path
+):
+    ex = Expando()
+    ex.correlation_id = "a1b2c3"
+    context.idempotency_store = IdempotencyStore(str(tmp_path / "store.sqlite"))
+    mediahaven_mock = MagicMock()
+    mediahaven_mock.records.search.return_value = MediaHavenPageObjectJSONMock(
+        [], nr_of_results=0
+    )
+    pid_pool_mock().get_pid.return_value = "12345678"
+    event = S3Event.from_dict(json.loads(S3_MOCK_ESSENCE_EVENT))
+
+    handle_create_event(event, ex, context, mediahaven_mock)
+    handle_create_event(event, ex, context, mediahaven_mock)
+
+    assert mediahaven_mock.records.search.call_count == 1
+    assert publisher_mock().publish.call_count == 1
+
+
+@patch("main.PIDPool")
+@patch("main.construct_destination_path", return_value="/VRT/essence")
+@patch("main.construct_essence_sidecar", return_value=b"<sidecar/>")
+@patch("main.get_cp_name", return_value="VRT")
+@patch("main.FTPPool")
+@patch("main.Publisher")
+def test_handle_create_event_resumes_after_ftp_failure(
+    publisher_mock,
+    ftp_mock,
+    get_cp_name_mock,
+    construct_essence_sidecar_mock,
+    construct_destination_path_mock,
+    pid_pool_mock,
+    context,
+    tmp_path,
+):
+    ex = Expando()
+    ex.correlation_id = "a1b2c3"
+    context.idempotency_store = IdempotencyStore(str(tmp_path / "store.sqlite"))
+    mediahaven_mock = MagicMock()
+    mediahaven_mock.records.search.return_value = MediaHavenPageObjectJSONMock(
+        [], nr_of_results=0
+    )
+    pid_pool_mock().get_pid.side_effect = ["12345678", "87654321"]
+    ftp_mock().put.side_effect = [ConnectionError(), None]
+    event = S3Event.from_dict(json.loads(S3_MOCK_ESSENCE_EVENT))
+
+    with pytest.raises(NackException) as error:
+        handle_create_event(event, ex, context, mediahaven_mock)
+    assert error.value.requeue
+    handle_create_event(event, ex, context, mediahaven_mock)
+
+    # Resumed at the transfer, with the same PID and sidecar
+    assert pid_pool_mock().get_pid.call_count == 1
+    assert construct_essence_sidecar_mock.call_count == 1
+    assert mediahaven_mock.records.search.call_count == 1
+    ftp_mock().put.assert_called_with(b"<sidecar/>", "/VRT/essence", "12345678.xml")
+    assert publisher_mock().publish.call_count == 1
+    assert "12345678" in publisher_mock().publish.call_args.args[0]
+
+
+@patch("main.PIDPool")
+@patch("main.construct_destination_path", return_value="/VRT/essence")
+@patch("main.construct_essence_sidecar", return_value=b"<sidecar/>")
+@patch("main.get_cp_name", return_value="VRT")
+@patch("main.FTPPool")
+@patch("main.Publisher")
+def test_callback_retries_after_ftp_failure(
+    publisher_mock,
+    ftp_mock,
+    get_cp_name_mock,
+    construct_essence_sidecar_mock,
+    construct_destination_path_mock,
+    pid_pool_mock,
+    context,
+    tmp_path,
+):
+    ex = Expando()
+    ex.correlation_id = "a1b2c3"
+    context.idempotency_store = IdempotencyStore(str(tmp_path / "store.sqlite"))
+    context.delayed_retry = MagicMock()
+    context.delayed_retry.schedule.return_value = 10
+    mediahaven_mock = MagicMock()
+    mediahaven_mock.records.search.return_value = MediaHavenPageObjectJSONMock(
+        [], nr_of_results=0
+    )
+    pid_pool_mock().get_pid.return_value = "12345678"
+    ftp_mock().put.side_effect = [ConnectionError(), None]
+    channel_mock = MagicMock()
+    method = MagicMock(delivery_tag=1)
+
+    callback(
+        channel_mock, method, ex, S3_MOCK_ESSENCE_EVENT, context, mediahaven_mock
+    )
+
+    # Retried later via a delay queue, not dropped
+    context.delayed_retry.schedule.assert_called_once_with(
+        channel_mock, 1, ex, S3_MOCK_ESSENCE_EVENT
+    )
+    assert not channel_mock.basic_nack.call_count
+
+    # The redelivery resumes at the transfer
+    callback(
+        channel_mock, method, ex, S3_MOCK_ESSENCE_EVENT, context, mediahaven_mock
+    )
+
+    channel_mock.basic_ack.assert_called_once_with(delivery_tag=1)
+    assert pid_pool_mock().get_pid.call_count == 1
+    assert ftp_mock().put.call_count == 2
+    assert publisher_mock().publish.call_count == 1
+
+
+@patch("main.PIDPool")
+@patch("main.construct_destination_path", return_value="/VRT/essence")
+@patch("main.construct_essence_sidecar", return_value=b"<sidecar/>")
+@patch("main.get_cp_name", return_value="VRT")
+@patch("main.FTPPool")
+@patch("main.Publisher")
+def test_handle_create_event_resumes_after_publish_failure(
+    publisher_mock,
+    ftp_mock,
+    get_cp_name_mock,
+    construct_essence_sidecar_mock,
+    construct_destination_path_mock,
+    pid_pool_mock,
+    context,
+    tmp_path,
+):
+    ex = Expando()
+    ex.correlation_id = "a1b2c3"
+    context.idempotency_store = IdempotencyStore(str(tmp_path / "store.sqlite"))
+    mediahaven_mock = MagicMock()
+    mediahaven_mock.records.search.return_value = MediaHavenPageObjectJSONMock(
+        [], nr_of_results=0
+    )
+    pid_pool_mock().get_pid.return_value = "12345678"
+    publisher_mock().publish.side_effect = [AMQPError(), None]
+    event = S3Event.from_dict(json.loads(S3_MOCK_ESSENCE_EVENT))
+
+    with pytest.raises(NackException) as error:
+        handle_create_event(event, ex, context, mediahaven_mock)
+    assert error.value.requeue
+    handle_create_event(event, ex, context, mediahaven_mock)
+
+    assert pid_pool_mock().get_pid.call_count == 1
+    assert ftp_mock().put.call_count == 1
+    # The transfer might have been requested: check again
+    assert mediahaven_mock.records.search.call_count == 2
+    assert publisher_mock().publish.call_count == 2
+
+
+@patch("main.construct_destination_path", return_value="/VRT/collateral")
+@patch("main.construct_collateral_sidecar", return_value=b"<sidecar/>")
+@patch("main.get_cp_name", return_value="VRT")
+@patch("main.FTPPool")
+@patch("main.Publisher")
+def test_handle_create_event_collateral_resumes_linking(
+    publisher_mock,
+    ftp_mock,
+    get_cp_name_mock,
+    construct_collateral_sidecar_mock,
+    construct_destination_path_mock,
+    context,
+    tmp_path,
+):
+    ex = Expando()
+    ex.correlation_id = "a1b2c3"
+    context.idempotency_store = IdempotencyStore(str(tmp_path / "store.sqlite"))
+    mediahaven_mock = MagicMock()
+    mediahaven_mock.records.search.side_effect = [
+        MediaHavenPageObjectJSONMock([], nr_of_results=0),
+        MediaHavenPageObjectJSONMock(
+            [{"Internal": {"FragmentId": 1}, "Dynamic": {"PID": "pid1"}}],
+            nr_of_results=1,
+        ),
+    ]
+    mediahaven_mock.records.update.side_effect = [RequestException(), None]
+    media_items.clear()
+    event = S3Event.from_dict(json.loads(S3_MOCK_COLLATERAL_EVENT))
+
+    with pytest.raises(NackException):
+        handle_create_event(event, ex, context, mediahaven_mock)
+    handle_create_event(event, ex, context, mediahaven_mock)
+
+    assert mediahaven_mock.records.search.call_count == 2
+    assert mediahaven_mock.records.update.call_count == 2
+    assert mediahaven_mock.records.update.call_args.args[0] == 1
+    assert construct_collateral_sidecar_mock.call_count == 1
+    assert ftp_mock().put.call_count == 1
+    assert publisher_mock().publish.call_count == 1
+
+
 @pytest.mark.parametrize(
     "body",
     [
@@ -177,9 +395,135 @@ def test_callback_unsuccessful(
     assert not channel_mock.basic_ack.call_count
 
 
+@patch("main.calculate_handler")
+def test_callback_circuit_open(calculate_handler_mock, context):
+    calculate_handler_mock.return_value.side_effect = CircuitOpenError("ftp", 10)
+    context.consumer = MagicMock()
+    channel_mock = MagicMock()
+    method = MagicMock(delivery_tag=1)
+
+    callback(
+        channel_mock, method, Expando(), S3_MOCK_ESSENCE_EVENT, context, MagicMock()
+    )
+
+    context.consumer.pause.assert_called_once_with(10)
+    channel_mock.basic_nack.assert_called_once_with(delivery_tag=1, requeue=True)
+    assert not channel_mock.basic_ack.call_count
+
+
+@patch("main.handle_remove_event")
+@patch("main.handle_create_event")
+def test_callback_defers_remove_behind_retried_create(
+    handle_create_event_mock, handle_remove_event_mock, context
+):
+    context.delayed_retry = MagicMock()
+    context.delayed_retry.schedule.return_value = 60
+    handle_create_event_mock.side_effect = [
+        NackException("MediaHaven is down", requeue=True),
+        None,
+    ]
+    channel_mock = MagicMock()
+    create, remove = S3_MOCK_COLLATERAL_EVENT, S3_MOCK_REMOVED_EVENT
+
+    # The create fails and awaits a retry: the remove has to wait behind it
+    callback(channel_mock, MagicMock(delivery_tag=1), Expando(), create, context, None)
+    callback(channel_mock, MagicMock(delivery_tag=2), Expando(), remove, context, None)
+
+    assert not handle_remove_event_mock.call_count
+    context.delayed_retry.defer.assert_called_once()
+    assert context.delayed_retry.defer.call_args.args[1] == 2
+    assert context.delayed_retry.defer.call_args.args[3] == remove
+    assert context.delayed_retry.defer.call_args.args[4] == 60
+
+    # The retried create comes back first, and then the remove
+    callback(channel_mock, MagicMock(delivery_tag=3), Expando(), create, context, None)
+    callback(channel_mock, MagicMock(delivery_tag=4), Expando(), remove, context, None)
+
+    assert handle_create_event_mock.call_count == 2
+    assert handle_remove_event_mock.call_count == 1
+    assert [call.kwargs for call in channel_mock.basic_ack.call_args_list] == [
+        {"delivery_tag": 3},
+        {"delivery_tag": 4},
+    ]
+
+
+def test_handle_nack_exception_requeue(context):
+    context.delayed_retry = MagicMock()
+    channel_mock = MagicMock()
+    method = MagicMock(delivery_tag=1)
+
+    handle_nack_exception(
+        NackException("Retry", requeue=True), channel_mock, method, None, b"", context
+    )
+
+    context.delayed_retry.schedule.assert_called_once_with(channel_mock, 1, None, b"")
+    assert not channel_mock.basic_nack.call_count
+
+
+def test_handle_nack_exception_no_requeue(context):
+    context.delayed_retry = MagicMock()
+    channel_mock = MagicMock()
+    method = MagicMock(delivery_tag=1)
+
+    handle_nack_exception(
+        NackException("Error"), channel_mock, method, None, b"", context
+    )
+
+    assert not context.delayed_retry.schedule.call_count
+    channel_mock.basic_nack.assert_called_once_with(delivery_tag=1, requeue=False)
+
+
+def test_ensure_mediahaven_token_failure(context):
+    context.token_manager = MagicMock()
+    context.token_manager.ensure_fresh.side_effect = RequestTokenError()
+
+    with pytest.raises(NackException) as exc_info:
+        ensure_mediahaven_token(context)
+
+    assert exc_info.value.requeue
+
+
+def test_parse_event():
+    event = parse_event(S3_MOCK_ESSENCE_EVENT)
+
+    assert event == S3Event.from_dict(json.loads(S3_MOCK_ESSENCE_EVENT))
+    assert isinstance(parse_event(b"not json"), json.JSONDecodeError)
+
+
+def test_event_key():
+    event = parse_event(S3_MOCK_ESSENCE_EVENT)
+
+    assert event_key(event) == (event.bucket, event.object_key)
+    assert event_key(event) != event_key(parse_event(S3_MOCK_COLLATERAL_EVENT))
+    assert event_key(parse_event(b"not json")) is None
+    assert event_key(parse_event(S3_MOCK_UNKNOWN_EVENT)) is not None
+
+
+@patch("main.calculate_handler")
+def test_callback_parsed_event(calculate_handler_mock, context):
+    event = parse_event(S3_MOCK_ESSENCE_EVENT)
+    channel_mock = MagicMock()
+    method = MagicMock(delivery_tag=1)
+
+    callback(channel_mock, method, Expando(), b"", context, MagicMock(), event)
+
+    calculate_handler_mock.assert_called_once_with(event)
+    channel_mock.basic_ack.assert_called_once_with(delivery_tag=1)
+
+
+def test_callback_parse_error(context):
+    channel_mock = MagicMock()
+    method = MagicMock(delivery_tag=1)
+    error = parse_event(b"not json")
+
+    callback(channel_mock, method, Expando(), b"not json", context, None, error)
+
+    channel_mock.basic_nack.assert_called_once_with(delivery_tag=1, requeue=False)
+
+
 def test_construct_essence_sidecar():
     # ARRANGE
-    event = json.loads(S3_MOCK_ESSENCE_EVENT)
+    event = S3Event.from_dict(json.loads(S3_MOCK_ESSENCE_EVENT))
 
     # ACT
     sidecar_xml = construct_essence_sidecar(event, "test_pid", "VRT")
@@ -190,7 +534,7 @@ def test_construct_essence_sidecar():
 
 def test_construct_collateral_sidecar():
     # ARRANGE
-    event = json.loads(S3_MOCK_COLLATERAL_EVENT)
+    event = S3Event.from_dict(json.loads(S3_MOCK_COLLATERAL_EVENT))
 
     # ACT
     sidecar_xml = construct_collateral_sidecar(
@@ -227,8 +571,50 @@ def test_get_cp_name_cached(context, mock_organisations_api):
     assert name == cp_name
 
 
+@patch("main.OrganisationsService")
+def test_warm_up_cp_names(org_service_mock, context):
+    org_service_mock().get_mam_labels.return_value = {"or-w1b2c3d": "WARM"}
+
+    warm_up_cp_names(context)
+
+    assert cp_names["OR-w1b2c3d"] == "WARM"
+
+
+@patch("main.OrganisationsService")
+def test_warm_up_cp_names_skips_invalid_organisations(org_service_mock, context):
+    org_service_mock().get_mam_labels.return_value = {
+        None: "NO OR ID",
+        "or-w1b2c3e": None,
+        123: "NOT A STRING",
+        "or-w1b2c3f": "VALID",
+    }
+
+    warm_up_cp_names(context)
+
+    assert cp_names["OR-w1b2c3f"] == "VALID"
+    assert "OR-w1b2c3e" not in cp_names
+
+
+@patch("main.threading.Timer")
+@patch("main.OrganisationsService")
+def test_warm_up_cp_names_reschedules_after_open_circuit(
+    org_service_mock, timer_mock, context
+):
+    org_service_mock().get_mam_labels.side_effect = CircuitOpenError(
+        "organisations-api", 30
+    )
+
+    with patch.dict(
+        context.config.app_cfg["organisations-api"], {"warm_up_interval": 60}
+    ):
+        warm_up_cp_names(context)
+
+    timer_mock.assert_called_once_with(60, warm_up_cp_names, args=(context,))
+    timer_mock().start.assert_called_once()
+
+
 def test_query_params_item_ingested():
-    event = json.loads(S3_MOCK_ESSENCE_EVENT)
+    event = S3Event.from_dict(json.loads(S3_MOCK_ESSENCE_EVENT))
     params = query_params_item_ingested(event, "cp")
     assert params == [
         (
@@ -242,7 +628,7 @@ def test_query_params_item_ingested():
 @pytest.mark.parametrize("cp", ["cp", "VRT"])
 def test_query_params_item_ingested_collateral(cp):
     """The item is a collateral, so check on md5 regardless of CP"""
-    event = json.loads(S3_MOCK_COLLATERAL_EVENT)
+    event = S3Event.from_dict(json.loads(S3_MOCK_COLLATERAL_EVENT))
     params = query_params_item_ingested(event, cp)
     assert params == [
         (
@@ -262,7 +648,7 @@ def test_query_params_item_ingested_collateral(cp):
     ],
 )
 def test_query_params_item_ingested_no_md5(cp, body):
-    event = json.loads(body)
+    event = S3Event.from_dict(json.loads(body))
     params = query_params_item_ingested(event, cp)
     assert params == [
         (
@@ -270,3 +656,231 @@ def test_query_params_item_ingested_no_md5(cp, body):
             "191213-VAN___statement_De_ideale_wereld___Don_12_December_2019-1983-d5be522e-3609-417a-a1f4-5922854620c8.MXF",
         )
     ]
+
+
+@patch("main.delete_media_object")
+def test_delete_media_objects_collects_failures(delete_media_object_mock, context):
+    def delete(mediahaven_client, fragment_id, reason):
+        if fragment_id == "ID3":
+            raise NackException("Error deleting", requeue=True)
+
+    delete_media_object_mock.side_effect = delete
+    deletions = [("ID3", "reason"), ("ID4", "reason"), ("ID5", "reason")]
+
+    failures = delete_media_objects(MagicMock(), deletions, context)
+
+    assert delete_media_object_mock.call_count == 3
+    assert [fragment_id for fragment_id, _ in failures] == ["ID3"]
+    assert failures[0][1].requeue
+
+
+@patch("main.delete_media_objects")
+def test_handle_remove_event_keeps_essence_on_failure(
+    delete_media_objects_mock, context, mock_organisations_api, mock_mediahaven_api
+):
+    delete_media_objects_mock.return_value = [("ID3", NackException("Error"))]
+    mediahaven_client = MediaHaven("", ROPCGrant("", "", ""))
+    event = S3Event.from_dict(json.loads(S3_MOCK_REMOVED_EVENT))
+
+    with patch("main.delete_media_object") as delete_media_object_mock:
+        with pytest.raises(NackException) as excinfo:
+            handle_remove_event(event, Expando(), context, mediahaven_client)
+
+    assert not delete_media_object_mock.call_count
+    assert excinfo.value.kwargs["fragment_ids"] == ["ID3"]
+
+
+def test_check_items_ingested_batch():
+    mediahaven_client = MagicMock()
+    mediahaven_client.records.search.return_value = MediaHavenPageObjectJSONMock(
+        [
+            {"Dynamic": {"s3_object_key": "key1"}, "Technical": {"Md5": "AB"}},
+            {"Dynamic": {"s3_object_key": "other"}, "Technical": {"Md5": "cd"}},
+        ],
+        nr_of_results=2,
+    )
+    batch = [
+        [("s3_object_key", "key1")],
+        [("s3_object_key", "key2"), ("md5", "CD")],
+        [("s3_object_key", "key3"), ("md5", "ef")],
+    ]
+
+    assert check_items_ingested(batch, mediahaven_client) == [True, True, False]
+    assert mediahaven_client.records.search.call_count == 1
+
+
+def test_check_items_ingested_batch_unmappable():
+    mediahaven_client = MagicMock()
+    mediahaven_client.records.search.side_effect = [
+        MediaHavenPageObjectJSONMock([{"Dynamic": {}}], nr_of_results=1),
+        MediaHavenPageObjectJSONMock([], nr_of_results=0),
+        MediaHavenPageObjectJSONMock([{"Dynamic": {}}], nr_of_results=1),
+    ]
+    batch = [[("s3_object_key", "key1")], [("s3_object_key", "key2")]]
+
+    assert check_items_ingested(batch, mediahaven_client) == [False, True]
+    assert mediahaven_client.records.search.call_count == 3
+
+
+def _record(fragment_id, is_fragment, local_id, bucket="bucket", key=None):
+    return {
+        "Internal": {"FragmentId": fragment_id, "IsFragment": is_fragment},
+        "Dynamic": {
+            "dc_identifier_localid": local_id,
+            "s3_bucket": bucket,
+            "s3_object_key": key,
+        },
+    }
+
+
+def test_plan_removals_batch(context):
+    events = []
+    for key in ("key1", "key2", "key3"):
+        event_dict = json.loads(S3_MOCK_REMOVED_EVENT)
+        event_dict["Records"][0]["s3"]["bucket"]["name"] = "bucket"
+        event_dict["Records"][0]["s3"]["object"]["key"] = key
+        events.append(S3Event.from_dict(event_dict))
+    mediahaven_client = MagicMock()
+    mediahaven_client.records.search.side_effect = [
+        MediaHavenPageObjectJSONMock(
+            [
+                _record("E1", False, "m1", key="key1"),
+                _record("F1", True, "m1_1", key="key1"),
+                _record("E2", False, "m2", key="key2"),
+            ],
+            nr_of_results=3,
+        ),
+        MediaHavenPageObjectJSONMock(
+            [_record("F1", True, "m1_1"), _record("C1", False, "m1_1")],
+            nr_of_results=2,
+        ),
+    ]
+
+    results = plan_removals(events, mediahaven_client, context)
+
+    assert results == [
+        RemovalPlan("bucket", "key1", "E1", {"m1_1": "F1"}, [("C1", "m1_1")], "m1"),
+        RemovalPlan("bucket", "key2", "E2", {}, [], "m2"),
+        None,
+    ]
+    assert mediahaven_client.records.search.call_count == 2
+
+
+def test_plan_removal_streams_results_once(context):
+    event = S3Event.from_dict(json.loads(S3_MOCK_REMOVED_EVENT))
+    result = MagicMock(nr_of_results=2)
+    result.as_generator.return_value = iter(
+        MediaHavenPageObjectJSONMock(
+            [_record("F1", True, "m1_1"), _record("E1", False, "m1")],
+            nr_of_results=2,
+        ).as_generator()
+    )
+    mediahaven_client = MagicMock()
+    mediahaven_client.records.search.side_effect = [
+        result,
+        MediaHavenPageObjectJSONMock([_record("C1", False, "m1_1")], nr_of_results=1),
+    ]
+
+    plan = plan_removal(event, mediahaven_client, context)
+
+    assert result.as_generator.call_count == 1
+    assert plan.essence_fragment_id == "E1"
+    assert plan.collateral_deletions()[0][0] == "C1"
+    assert plan.summary()["nr_of_collaterals"] == 1
+
+
+def test_search_collaterals_in_chunks(context, monkeypatch):
+    monkeypatch.setitem(
+        context.config.app_cfg["mediahaven-api"], "fragment_lookup_chunk_size", 2
+    )
+    mediahaven_client = MagicMock()
+    mediahaven_client.records.search.side_effect = lambda q: (
+        MediaHavenPageObjectJSONMock(
+            [
+                _record(f"C_{media_id}", False, media_id)
+                for media_id in ("m1", "m2", "m3", "m4", "m5")
+                if f'"{media_id}"' in q
+            ],
+            nr_of_results=1,
+        )
+    )
+
+    collaterals = search_collaterals(
+        mediahaven_client, ["m1", "m2", "m3", "m4", "m5"], context
+    )
+
+    assert mediahaven_client.records.search.call_count == 3
+    assert collaterals == [
+        ("C_m1", "m1"),
+        ("C_m2", "m2"),
+        ("C_m3", "m3"),
+        ("C_m4", "m4"),
+        ("C_m5", "m5"),
+    ]
+
+
+@patch("main.Publisher")
+@patch("main.FTPPool")
+def test_handle_create_event_collateral_cached(
+    ftp_mock, publisher_mock, context, mock_organisations_api
+):
+    media_items.clear()
+    mediahaven_client = MagicMock()
+    mediahaven_client.records.search.side_effect = lambda q: (
+        MediaHavenPageObjectJSONMock([], nr_of_results=0)
+        if "s3_object_key" in q
+        else MediaHavenPageObjectJSONMock(
+            [{"Internal": {"FragmentId": 1}, "Dynamic": {"PID": "pid1"}}],
+            nr_of_results=1,
+        )
+    )
+    event = S3Event.from_dict(json.loads(S3_MOCK_COLLATERAL_EVENT))
+    ex = Expando()
+    ex.correlation_id = "a1b2c3"
+
+    handle_create_event(event, ex, context, mediahaven_client)
+    handle_create_event(event, ex, context, mediahaven_client)
+
+    # Twice the already-ingested check, once the media ID lookup
+    assert mediahaven_client.records.search.call_count == 3
+    assert media_items["MEDIAID"] == ("pid1", 1)
+
+
+@patch("main.delete_media_object")
+def test_execute_removal_plan_invalidates_media_items(
+    delete_media_object_mock, context
+):
+    media_items["m1"] = ("pid1", "E1")
+    media_items["m1_1"] = ("pid1_1", "F1")
+    plan = RemovalPlan("bucket", "key1", "E1", {"m1_1": "F1"}, [], "m1")
+
+    execute_removal_plan(plan, MagicMock(), context)
+
+    assert "m1" not in media_items
+    assert "m1_1" not in media_items
+
+
+@patch("main.delete_media_object")
+def test_execute_removal_plan_invalidates_media_items_after_deleting(
+    delete_media_object_mock, context
+):
+    plan = RemovalPlan("bucket", "key1", "E1", {}, [], "m1")
+    # A concurrent collateral create caches the item while it gets deleted
+    delete_media_object_mock.side_effect = lambda *args: media_items.__setitem__(
+        "m1", ("pid1", "E1")
+    )
+
+    execute_removal_plan(plan, MagicMock(), context)
+
+    assert "m1" not in media_items
+
+
+def test_parse_args_refuses_workers_when_ordered():
+    assert parse_args([]).workers == 1
+    with pytest.raises(SystemExit):
+        parse_args(["--workers", "4"])
+
+
+def test_parse_args_allows_workers_when_unordered():
+    with patch.dict(main_config.app_cfg["consumer"], {"ordered": False}):
+        assert parse_args(["--workers", "4"]).workers == 4
@@ -0,0 +1,103 @@
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+from meemoo.oauth import TokenManager, grant_fetcher
+
+
+def test_token_manager_refreshes_before_expiry():
+    fetch = MagicMock(
+        side_effect=[
+            {"access_token": "first", "expires_in": 60},
+            {"access_token": "second", "expires_in": 3600},
+        ]
+    )
+    tokens = TokenManager(fetch, refresh_margin=30)
+
+    assert tokens.get_token_info()["access_token"] == "first"
+    assert tokens.get_token_info()["access_token"] == "first"
+    # Within the refresh margin
+    tokens.expires_at = time.monotonic() + 10
+    assert tokens.get_token_info()["access_token"] == "second"
+    assert fetch.call_count == 2
+
+
+def test_token_manager_single_flights_refreshes():
+    release = threading.Event()
+
+    def fetch():
+        release.wait(1)
+        return {"access_token": "token", "expires_in": 3600}
+
+    fetch_mock = MagicMock(side_effect=fetch)
+    tokens = TokenManager(fetch_mock)
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(tokens.get_token_info()))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 5
+    assert fetch_mock.call_count == 1
+
+
+def test_token_manager_refreshes_in_background():
+    fetch = MagicMock(return_value={"access_token": "token", "expires_in": 0.05})
+    tokens = TokenManager(fetch, refresh_margin=0.04)
+
+    tokens.start()
+    for _ in range(100):
+        if fetch.call_count > 1:
+            break
+        time.sleep(0.01)
+    tokens.stop()
+
+    assert fetch.call_count > 1
+
+
+def test_token_manager_invalidate_keeps_newer_token():
+    fetch = MagicMock(
+        side_effect=lambda: {"access_token": "token", "expires_in": 3600}
+    )
+    tokens = TokenManager(fetch)
+    stale = tokens.get_token_info()
+    tokens.refresh(force=True)
+
+    tokens.invalidate(stale)
+    tokens.get_token_info()
+    assert fetch.call_count == 2
+
+    tokens.invalidate(tokens.token_info)
+    tokens.get_token_info()
+    assert fetch.call_count == 3
+
+
+def test_grant_fetcher_returned_token():
+    grant = MagicMock()
+    grant.request_token.return_value = {"access_token": "token", "expires_in": 60}
+
+    assert grant_fetcher(grant, "user", "passwd")()["expires_in"] == 60
+
+
+@patch("meemoo.oauth.log")
+def test_grant_fetcher_warns_without_token(log_mock):
+    grant = MagicMock(spec=["request_token"])
+    grant.request_token.return_value = None
+
+    assert grant_fetcher(grant, "user", "passwd")() is None
+    assert log_mock.warning.call_count == 1
+
+
+def test_grant_fetcher():
+    grant = MagicMock()
+    grant.request_token.return_value = None
+    grant._token_dict = {"access_token": "token", "expires_in": 3600}
+
+    assert grant_fetcher(grant, "user", "passwd")() == grant._token_dict
+    grant.request_token.assert_called_once_with("user", "passwd")
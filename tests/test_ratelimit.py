@@ -0,0 +1,110 @@
+import time
+from unittest.mock import MagicMock
+
+import pytest
+from requests.exceptions import HTTPError
+
+from meemoo.ratelimit import (
+    AdaptiveRateLimiter,
+    ThrottledResource,
+    TokenBucket,
+    get_throttling,
+    parse_retry_after,
+)
+
+
+def _http_error(status_code, headers=None):
+    response = MagicMock(status_code=status_code, headers=headers or {})
+    return HTTPError(response=response)
+
+
+def test_token_bucket_allows_burst():
+    bucket = TokenBucket(rate=100, burst=5)
+
+    start = time.monotonic()
+    for _ in range(5):
+        bucket.acquire()
+
+    assert time.monotonic() - start < 0.05
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=50, burst=1)
+
+    start = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+
+    # The first token is available immediately, the next 5 take 20ms each
+    assert time.monotonic() - start >= 0.09
+
+
+def test_adaptive_rate_limiter_aimd():
+    limiter = AdaptiveRateLimiter(rate=10, min_rate=1, max_rate=11)
+
+    limiter.on_throttle()
+    assert limiter.rate == 5
+    # Only decreases once for the calls that were in flight
+    limiter.on_throttle()
+    assert limiter.rate == 5
+
+    for _ in range(100):
+        limiter.on_success()
+    assert limiter.rate == 11
+
+
+def test_adaptive_rate_limiter_honours_retry_after():
+    limiter = AdaptiveRateLimiter(rate=100)
+    limiter.on_throttle(retry_after=0.1)
+
+    start = time.monotonic()
+    limiter.acquire()
+
+    assert time.monotonic() - start >= 0.09
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("2") == 2
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+    assert parse_retry_after("invalid") is None
+    assert parse_retry_after(None) is None
+
+
+def test_get_throttling():
+    assert get_throttling(_http_error(429, {"Retry-After": "3"})) == (True, 3)
+    assert get_throttling(_http_error(503)) == (True, None)
+    assert get_throttling(_http_error(500)) == (False, None)
+    assert get_throttling(ValueError()) == (False, None)
+
+
+def test_throttled_resource_retries_throttled_calls():
+    limiter = MagicMock()
+    records = MagicMock()
+    records.search.side_effect = [_http_error(429, {"Retry-After": "1"}), "result"]
+
+    assert ThrottledResource(records, limiter).search(q="query") == "result"
+
+    assert records.search.call_count == 2
+    limiter.on_throttle.assert_called_once_with(1)
+    limiter.on_success.assert_called_once_with()
+
+
+def test_throttled_resource_gives_up():
+    limiter = MagicMock()
+    records = MagicMock()
+    records.delete.side_effect = _http_error(503)
+
+    with pytest.raises(HTTPError):
+        ThrottledResource(records, limiter, max_attempts=2).delete("1", "reason")
+
+    assert records.delete.call_count == 2
+
+
+def test_throttled_resource_does_not_retry_other_errors():
+    records = MagicMock()
+    records.update.side_effect = _http_error(500)
+
+    with pytest.raises(HTTPError):
+        ThrottledResource(records, MagicMock()).update("1")
+
+    assert records.update.call_count == 1
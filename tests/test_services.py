@@ -1,6 +1,19 @@
+import time
+from unittest.mock import MagicMock, patch
+
 import pytest
+from requests.exceptions import HTTPError, RequestException
 
-from meemoo.services import Service
+from meemoo.circuitbreaker import CircuitOpenError
+from meemoo.services import (
+    AuthenticationException,
+    MediahavenService,
+    OrganisationsService,
+    OrgApiError,
+    PIDPool,
+    PIDService,
+    Service,
+)
 
 
 class UnknownHostServiceTest(Service):
@@ -26,3 +39,168 @@ def test_get_service_host_not_found(context, caplog):
     assert log_record.message == (
         "The key 'host' not found in the config for service: unknown"
     )
+
+
+def test_pid_pool_refills_in_batches(context):
+    pool = PIDPool(context, batch_size=5, low_water_mark=1)
+    pool.service = MagicMock()
+    pool.service.get_pids.return_value = ["pid1", "pid2", "pid3", "pid4", "pid5"]
+
+    # Empty pool: fall back to a synchronous fetch and refill in the background
+    pool.service.get_pid.return_value = "sync_pid"
+    assert pool.get_pid() == "sync_pid"
+    _wait_for_refill(pool)
+    pool.service.get_pids.assert_called_once_with(5)
+
+    assert [pool.get_pid() for _ in range(3)] == ["pid1", "pid2", "pid3"]
+    assert pool.service.get_pid.call_count == 1
+
+
+def test_pid_pool_refill_failure_falls_back(context):
+    pool = PIDPool(context, batch_size=5, low_water_mark=1)
+    pool.service = MagicMock()
+    pool.service.get_pids.side_effect = RequestException("PID service down")
+    pool.service.get_pid.return_value = "sync_pid"
+
+    assert pool.get_pid() == "sync_pid"
+    _wait_for_refill(pool)
+    assert pool.get_pid() == "sync_pid"
+    assert pool.service.get_pid.call_count == 2
+
+
+def test_pid_pool_refills_after_open_circuit(context):
+    pool = PIDPool(context, batch_size=2, low_water_mark=0)
+    pool.service = MagicMock()
+    pool.service.get_pids.side_effect = [
+        CircuitOpenError("pid-service", 30),
+        ["pid1", "pid2"],
+    ]
+    pool.service.get_pid.return_value = "sync_pid"
+
+    assert pool.get_pid() == "sync_pid"
+    _wait_for_refill(pool)
+    assert not pool.refilling
+
+    # The breaker recovered: the next refill goes through
+    assert pool.get_pid() == "sync_pid"
+    _wait_for_refill(pool)
+    assert [pool.get_pid() for _ in range(2)] == ["pid1", "pid2"]
+    assert pool.service.get_pids.call_count >= 2
+    assert pool.service.get_pid.call_count == 2
+
+
+def _wait_for_refill(pool):
+    for _ in range(100):
+        if not pool.refilling:
+            return
+        time.sleep(0.01)
+
+
+@patch("meemoo.services.requests.Session.post")
+def test_get_mam_labels_paginates(post_mock, context):
+    post_mock.return_value.json.side_effect = [
+        {
+            "data": {
+                "organizations": [
+                    {"or_id": "OR-a1b2c3d", "mam_label": "CP1"},
+                    {"or_id": "OR-b1b2c3d", "mam_label": None},
+                ]
+            }
+        },
+        {"data": {"organizations": [{"or_id": "OR-c1b2c3d", "mam_label": "CP3"}]}},
+    ]
+
+    mam_labels = OrganisationsService(context).get_mam_labels(page_size=2)
+
+    assert mam_labels == {"OR-a1b2c3d": "CP1", "OR-c1b2c3d": "CP3"}
+    assert post_mock.call_count == 2
+    assert "offset:2" in post_mock.call_args.kwargs["json"]["query"]
+
+
+@patch("meemoo.services.requests.Session.post")
+def test_get_mam_labels_error(post_mock, context):
+    post_mock.return_value.json.return_value = {"errors": ["Bad query"]}
+
+    with pytest.raises(OrgApiError):
+        OrganisationsService(context).get_mam_labels()
+
+
+def test_service_sessions_are_shared_per_host(context):
+    session = PIDService(context).session
+
+    assert PIDService(context).session is session
+    assert OrganisationsService(context).session is not session
+    assert session.get_adapter("http://pid_host").max_retries.total == 3
+
+
+@patch("meemoo.services.requests.Session.get")
+def test_service_requests_have_timeouts(get_mock, context):
+    context.dryrun = False
+    get_mock.return_value.json.return_value = [{"id": "pid1", "number": 1}]
+
+    assert PIDService(context).get_pid() == "pid1"
+    assert get_mock.call_args.kwargs["timeout"] == (5.0, 30.0)
+
+
+def test_mediahaven_service_reuses_token(context):
+    service = MediahavenService(context, "cp_reuse")
+    service.tokens.fetch = MagicMock(
+        return_value={"access_token": "token", "expires_in": 3600}
+    )
+    service.session.get = MagicMock()
+
+    service.get_fragment([("MediaObjectId", "1")])
+    service.get_fragment([("MediaObjectId", "2")])
+
+    assert service.tokens.fetch.call_count == 1
+    headers = service.session.get.call_args.kwargs["headers"]
+    assert headers["Authorization"] == "Bearer token"
+
+
+def test_mediahaven_service_refreshes_rejected_token(context):
+    service = MediahavenService(context, "cp_rejected")
+    service.tokens.fetch = MagicMock(
+        side_effect=[
+            {"access_token": "revoked", "expires_in": 3600},
+            {"access_token": "token", "expires_in": 3600},
+        ]
+    )
+    response = MagicMock(status_code=401)
+    service.session.get = MagicMock(side_effect=[response, MagicMock()])
+
+    service.get_fragment([("MediaObjectId", "1")])
+
+    assert service.tokens.fetch.call_count == 2
+    headers = service.session.get.call_args.kwargs["headers"]
+    assert headers["Authorization"] == "Bearer token"
+
+
+def test_mediahaven_service_tokens_are_shared_per_cp(context):
+    tokens = MediahavenService(context, "cp_shared").tokens
+    tokens.fetch = MagicMock(
+        return_value={"access_token": "token", "expires_in": 3600}
+    )
+
+    for _ in range(2):
+        service = MediahavenService(context, "cp_shared")
+        assert service.token_info["access_token"] == "token"
+    assert MediahavenService(context, "cp_other").tokens is not tokens
+    assert tokens.fetch.call_count == 1
+
+
+@patch("meemoo.services.requests.Session.get")
+def test_service_server_errors_open_the_circuit(get_mock, context):
+    context.dryrun = False
+    get_mock.return_value = MagicMock(status_code=503)
+    get_mock.return_value.raise_for_status.side_effect = HTTPError(
+        response=get_mock.return_value
+    )
+    service = PIDService(context)
+    service.breaker.failure_threshold = 1
+
+    with pytest.raises(HTTPError):
+        service.get_pid()
+    with pytest.raises(CircuitOpenError):
+        service.get_pid()
+
+    assert get_mock.call_count == 1
@@ -0,0 +1,56 @@
+import os
+import signal
+import sys
+import threading
+import time
+
+from meemoo.supervisor import Supervisor
+
+
+def _crash():
+    sys.exit(1)
+
+
+def _drain_on_sigterm(path):
+    def on_sigterm(signum, frame):
+        with open(path, "a") as f:
+            f.write(f"{os.getpid()}\n")
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, on_sigterm)
+    while True:
+        time.sleep(0.01)
+
+
+def _run_for(supervisor, seconds):
+    threading.Timer(seconds, supervisor.stop).start()
+    supervisor.run()
+
+
+def test_supervisor_restarts_crashed_workers_with_backoff():
+    supervisor = Supervisor(_crash, 2, backoff=0.01, max_backoff=0.04)
+
+    _run_for(supervisor, 0.5)
+
+    assert supervisor.restarts >= 4
+    assert max(supervisor.backoffs.values()) == 0.04
+    assert not any(process.is_alive() for process in supervisor.workers.values())
+
+
+def test_supervisor_forwards_sigterm(tmp_path):
+    path = tmp_path / "drained"
+    supervisor = Supervisor(lambda: _drain_on_sigterm(path), 3)
+
+    _run_for(supervisor, 0.3)
+
+    assert len(path.read_text().splitlines()) == 3
+    assert supervisor.restarts == 0
+    assert all(process.exitcode == 0 for process in supervisor.workers.values())
+
+
+def test_supervisor_restores_signal_handlers():
+    handler = signal.getsignal(signal.SIGTERM)
+
+    _run_for(Supervisor(_crash, 1, backoff=0.01), 0.05)
+
+    assert signal.getsignal(signal.SIGTERM) is handler
@@ -0,0 +1,169 @@
+import threading
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+from meemoo.workers import KeyedExecutor, ThreadSafeChannel, WorkerPool
+
+
+def _connection_mock():
+    """Connection that runs threadsafe callbacks immediately."""
+    connection = MagicMock()
+    connection.add_callback_threadsafe.side_effect = lambda cb: cb()
+    return connection
+
+
+def test_thread_safe_channel_marshals_acks():
+    connection = _connection_mock()
+    channel = MagicMock()
+    safe_channel = ThreadSafeChannel(connection, channel)
+
+    safe_channel.basic_ack(delivery_tag=1)
+    safe_channel.basic_nack(delivery_tag=2, requeue=True)
+
+    assert connection.add_callback_threadsafe.call_count == 2
+    channel.basic_ack.assert_called_once_with(delivery_tag=1)
+    channel.basic_nack.assert_called_once_with(delivery_tag=2, requeue=True)
+
+
+def test_worker_pool_dispatch():
+    connection = _connection_mock()
+    channel = MagicMock()
+    method = MagicMock(delivery_tag=1)
+
+    def handler(ch, method, properties, body):
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    pool = WorkerPool(connection, 2, handler)
+    pool.dispatch(channel, method, MagicMock(), b"{}")
+    pool.shutdown()
+
+    channel.basic_ack.assert_called_once_with(delivery_tag=1)
+    assert not channel.basic_nack.call_count
+
+
+def test_worker_pool_nacks_on_unexpected_error():
+    connection = _connection_mock()
+    channel = MagicMock()
+    method = MagicMock(delivery_tag=1)
+
+    def handler(ch, method, properties, body):
+        raise RuntimeError("boom")
+
+    pool = WorkerPool(connection, 2, handler)
+    pool.dispatch(channel, method, MagicMock(), b"{}")
+    pool.shutdown()
+
+    channel.basic_nack.assert_called_once_with(delivery_tag=1, requeue=False)
+    assert not channel.basic_ack.call_count
+
+
+def test_worker_pool_drain_serves_the_connection():
+    # Like a BlockingConnection: threadsafe callbacks only run when the
+    # connection thread processes data events
+    callbacks = []
+    connection = MagicMock()
+    connection.is_open = True
+    connection.add_callback_threadsafe.side_effect = callbacks.append
+
+    def process_data_events(time_limit=None):
+        while callbacks:
+            callbacks.pop(0)()
+        time.sleep(0.01)
+
+    connection.process_data_events.side_effect = process_data_events
+    channel = MagicMock()
+    method = MagicMock(delivery_tag=1)
+
+    def handler(ch, method, properties, body):
+        # Like the Publisher: wait for the connection thread to publish
+        published = threading.Event()
+        connection.add_callback_threadsafe(published.set)
+        assert published.wait(timeout=2)
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    pool = WorkerPool(connection, 2, handler)
+    pool.dispatch(channel, method, MagicMock(), b"{}")
+    pool.drain()
+
+    channel.basic_ack.assert_called_once_with(delivery_tag=1)
+    assert not pool.executor.busy()
+
+
+def test_keyed_executor_runs_same_key_in_order():
+    executor = KeyedExecutor(4)
+    order = []
+
+    def task(name, delay):
+        time.sleep(delay)
+        order.append(name)
+
+    executor.submit("key", task, "create", 0.05)
+    executor.submit("key", task, "remove", 0)
+    executor.shutdown()
+
+    assert order == ["create", "remove"]
+    assert not executor.lanes
+
+
+def test_keyed_executor_runs_other_keys_in_parallel():
+    executor = KeyedExecutor(2)
+    release = threading.Event()
+
+    blocked = executor.submit("a", release.wait, 1)
+    other = executor.submit("b", lambda: "done")
+
+    assert other.result(timeout=0.5) == "done"
+    assert not blocked.done()
+    release.set()
+    executor.shutdown()
+
+
+def test_keyed_executor_continues_lane_after_error():
+    executor = KeyedExecutor(1)
+
+    failed = executor.submit("key", MagicMock(side_effect=RuntimeError("boom")))
+    succeeded = executor.submit("key", lambda: "done")
+    executor.shutdown()
+
+    with pytest.raises(RuntimeError):
+        failed.result()
+    assert succeeded.result() == "done"
+
+
+def test_worker_pool_orders_by_key():
+    connection = _connection_mock()
+    channel = MagicMock()
+    acked = []
+
+    def handler(ch, method, properties, body):
+        if body == b"create":
+            time.sleep(0.05)
+        acked.append(body)
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    pool = WorkerPool(connection, 4, handler, key=lambda body: "object_key")
+    pool.dispatch(channel, MagicMock(delivery_tag=1), MagicMock(), b"create")
+    pool.dispatch(channel, MagicMock(delivery_tag=2), MagicMock(), b"remove")
+    pool.shutdown()
+
+    assert acked == [b"create", b"remove"]
+    assert channel.basic_ack.call_count == 2
+
+
+def test_worker_pool_parses_once():
+    connection = _connection_mock()
+    channel = MagicMock()
+    parse = MagicMock(side_effect=lambda body: body.decode())
+    handled = []
+
+    def handler(ch, method, properties, body, parsed):
+        handled.append((body, parsed))
+
+    pool = WorkerPool(connection, 2, handler, parse=parse, key=lambda parsed: parsed)
+    pool.dispatch(channel, MagicMock(delivery_tag=1), MagicMock(), b"create")
+    pool.shutdown()
+
+    parse.assert_called_once_with(b"create")
+    assert handled == [(b"create", "create")]